@@ -0,0 +1,106 @@
+# Synthetic grammars and words for the benchmarks. Grammars are produced as
+# lines of the CFG text format so loading them is part of what is measured.
+
+import random
+
+from src.cfg import Lambda, NonTerminal, Terminal
+
+
+# returns the lines of a random grammar with start symbol S
+#
+# rule_count = the number of random rules, on top of one terminal rule per non-terminal
+# rhs_length = the maximal number of variables on a rhs, random rules have at least
+#              two so unit rules only come from the chain and from lambda removal
+# nullable_density = the fraction of non-terminals that get a lambda rule
+# unit_depth = the length of a chain of unit rules S -> U1 -> U2 .. hanging off S
+# terminal_count = the number of distinct terminals, at most 26
+def generate_grammar(rule_count, rhs_length, nullable_density=0.0, unit_depth=0, terminal_count=4, seed=0):
+    rng = random.Random(seed)
+    terminals = [chr(ord("a") + i) for i in range(min(terminal_count, 26))]
+    non_terminals = ["S"] + ["N" + str(i) for i in range(1, max(2, rule_count // 4))]
+
+    lines = []
+    # a terminal rule per non-terminal keeps every non-terminal productive
+    for var in non_terminals:
+        lines.append(var + " -> " + rng.choice(terminals))
+
+    for _ in range(rule_count):
+        rhs = ""
+        for _ in range(rng.randint(2, max(2, rhs_length))):
+            if rng.random() < 0.6:
+                rhs += rng.choice(non_terminals)
+            else:
+                rhs += rng.choice(terminals)
+        lines.append(rng.choice(non_terminals) + " -> " + rhs)
+
+    for var in non_terminals:
+        if rng.random() < nullable_density:
+            lines.append(var + " -> &")
+
+    if unit_depth > 0:
+        lines.append("S -> U1")
+        for i in range(1, unit_depth):
+            lines.append("U" + str(i) + " -> U" + str(i + 1))
+        lines.append("U" + str(unit_depth) + " -> " + rng.choice(non_terminals[1:]) + rng.choice(terminals))
+
+    return lines
+
+
+# the length of the shortest word every non-terminal derives
+def _min_yields(cfg):
+    ret = dict()
+    changed = True
+    while changed:
+        changed = False
+        for key, rules in cfg.production_rules.items():
+            for rule in rules:
+                total = 0
+                for var in rule.rhs:
+                    if isinstance(var, NonTerminal):
+                        if var not in ret:
+                            total = None
+                            break
+                        total += ret[var]
+                    elif isinstance(var, Terminal):
+                        total += 1
+                if total is not None and total < ret.get(key, total + 1):
+                    ret[key] = total
+                    changed = True
+    return ret
+
+
+# returns 'count' words of the language of 'cfg' of about 'length' tokens each,
+# built by random leftmost derivations that fall back to the shortest rules
+# once the target length is reached
+def accepted_words(cfg, length, count, rng):
+    min_yields = _min_yields(cfg)
+    return [_accepted_word(cfg, length, rng, min_yields) for _ in range(count)]
+
+
+def _accepted_word(cfg, length, rng, min_yields):
+    word = []
+    pending = [cfg.start_var]
+    while pending:
+        var = pending.pop()
+        if not isinstance(var, NonTerminal):
+            if isinstance(var, Terminal):
+                word.append(var)
+            continue
+
+        # sorted, the set order depends on the addresses of the symbols
+        rules = sorted((rule for rule in cfg.production_rules.get(var, ())
+                        if all(not isinstance(v, NonTerminal) or v in min_yields for v in rule.rhs)), key=str)
+        budget = length - len(word) - sum(min_yields.get(v, 1) for v in pending if not isinstance(v, Lambda))
+        if budget > min_yields[var]:
+            growing = [rule for rule in rules if any(isinstance(v, NonTerminal) for v in rule.rhs)]
+            rule = rng.choice(growing if growing else rules)
+        else:
+            rule = min(rules, key=lambda r: sum(min_yields.get(v, 1) if not isinstance(v, Lambda) else 0
+                                                 for v in r.rhs))
+        pending.extend(reversed(rule.rhs))
+
+    return word
+
+
+def random_word(terminals, length, rng):
+    return [rng.choice(terminals) for _ in range(length)]
@@ -0,0 +1,183 @@
+# Reproducible benchmark suite for loading, the grammar transforms and the
+# CYK parser. Every case is generated from a fixed seed, so two runs on
+# different commits measure the same work.
+#
+#   python -m benchmarks.run --output before.json
+#   python -m benchmarks.run --output after.json --compare before.json
+
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.grammar_gen import accepted_words, generate_grammar, random_word
+from src.cfg import CFG
+from src.cfg_modify import remove_lambdas, remove_nonproductive_rules, remove_nonreachable_rules, \
+    remove_unit_rules, remove_useless_vars
+from src.chomsky import transform_to_CNF
+from src.CYK_parser import CompiledCNF, cyk_parser
+from src.parser import parse_file_path, parse_rule
+
+# (name, grammar parameters, word lengths)
+CASES = [
+    ("small", dict(rule_count=40, rhs_length=4, nullable_density=0.1, unit_depth=2), [8, 16]),
+    ("long_rhs", dict(rule_count=40, rhs_length=8, nullable_density=0.1, unit_depth=0), [16]),
+    ("nullable", dict(rule_count=80, rhs_length=5, nullable_density=0.5, unit_depth=0), [16]),
+    ("unit_chain", dict(rule_count=80, rhs_length=3, nullable_density=0.0, unit_depth=40), [16]),
+    ("large", dict(rule_count=1000, rhs_length=4, nullable_density=0.1, unit_depth=5), [16, 32]),
+]
+
+QUICK_CASES = [case for case in CASES if case[0] in ("small", "unit_chain")]
+
+TRANSFORMS = [remove_lambdas, remove_unit_rules, remove_nonproductive_rules, remove_nonreachable_rules,
+              remove_useless_vars, transform_to_CNF]
+
+
+# the best of 'repeat' runs of function(setup()), only the call itself is
+# timed and the garbage collector is off while it runs, as in timeit
+def best_time(function, setup, repeat):
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function(arg)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _load_lines(lines):
+    cfg = CFG()
+    for line in lines:
+        parse_rule(cfg, line)
+    return cfg
+
+
+def _words(cnf, lengths, count, rng):
+    terminals = sorted(cnf.terminals, key=str)
+    compiled = CompiledCNF(cnf)
+    accepted = []
+    rejected = []
+    for length in lengths:
+        accepted += accepted_words(cnf, length, count, rng)
+        target = len(rejected) + count
+        tries = 0
+        while len(rejected) < target and tries < 100 * count:
+            word = random_word(terminals, length, rng)
+            if not compiled.parse(word):
+                rejected.append(word)
+            tries += 1
+    return accepted, rejected
+
+
+def run_case(name, params, lengths, repeat, seed):
+    results = []
+
+    def record(benchmark, seconds, **extra):
+        results.append(dict(case=name, benchmark=benchmark, params=params, seconds=seconds, **extra))
+
+    lines = generate_grammar(seed=seed, **params)
+    record("parse_rule", best_time(_load_lines, lambda: lines, repeat), rules=len(lines))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, name + ".txt")
+        with open(path, "w") as f:
+            f.write("\n".join(lines))
+        record("parse_file_path", best_time(lambda p: parse_file_path(CFG(), p), lambda: path, repeat))
+
+    cfg = _load_lines(lines)
+    for transform in TRANSFORMS:
+        record(transform.__name__, best_time(transform, lambda: copy.deepcopy(cfg), repeat))
+
+    cnf = copy.deepcopy(cfg)
+    transform_to_CNF(cnf)
+    rng = random.Random(seed)
+    accepted, rejected = _words(cnf, lengths, 3, rng)
+    for kind, words in (("accepted", accepted), ("rejected", rejected)):
+        if words:
+            seconds = best_time(lambda ws: [cyk_parser(cnf, w) for w in ws], lambda: words, repeat)
+            record("cyk_parser_" + kind, seconds, words=len(words),
+                   tokens=sum(len(w) for w in words))
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return result["case"], result["benchmark"]
+
+
+# prints the ratio new / old of every benchmark present in both runs and
+# returns the ones slower than 'threshold'. Benchmarks that took less than
+# 'min_seconds' in both runs are too noisy to count as regressions.
+def compare(old, new, threshold, min_seconds):
+    old_results = {_key(result): result for result in old["results"]}
+    regressions = []
+    print("%-12s %-28s %10s %10s %7s" % ("case", "benchmark", "old", "new", "ratio"))
+    for result in new["results"]:
+        before = old_results.get(_key(result))
+        if before is None:
+            continue
+        ratio = result["seconds"] / before["seconds"] if before["seconds"] > 0 else float("inf")
+        noisy = max(result["seconds"], before["seconds"]) < min_seconds
+        flag = " <-- regression" if ratio > threshold and not noisy else ""
+        print("%-12s %-28s %10.5f %10.5f %7.2f%s" % (result["case"], result["benchmark"], before["seconds"],
+                                                     result["seconds"], ratio, flag))
+        if flag:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks for grammar loading, transforms and parsing")
+    arg_parser.add_argument("--output", help="file the JSON results are written to, stdout if not given")
+    arg_parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    arg_parser.add_argument("--threshold", type=float, default=1.25,
+                            help="ratio new / old above which a benchmark counts as a regression")
+    arg_parser.add_argument("--min-seconds", type=float, default=0.005,
+                            help="benchmarks faster than this in both runs are never flagged")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--quick", action="store_true", help="only run the small cases")
+    args = arg_parser.parse_args()
+
+    results = []
+    for name, params, lengths in (QUICK_CASES if args.quick else CASES):
+        results += run_case(name, params, lengths, args.repeat, args.seed)
+
+    report = dict(meta=dict(commit=_commit(), python=platform.python_version(), platform=platform.platform(),
+                            seed=args.seed, repeat=args.repeat, time=time.strftime("%Y-%m-%dT%H:%M:%S")),
+                  results=results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, report, args.threshold, args.min_seconds):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
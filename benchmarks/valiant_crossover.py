@@ -0,0 +1,86 @@
+# Times the classic cyk_parser, the bitset chart and the Valiant style matrix
+# multiplication recognizer on words of doubling length and reports the first
+# length where the Valiant recognizer is faster.
+#
+#   python -m benchmarks.valiant_crossover --max-length 1024
+
+import argparse
+import random
+import time
+
+from src.cfg import Terminal
+from src.chomsky import transform_to_CNF
+from src.CYK_parser import CompiledCNF, cyk_parser
+from src.parser import load_grammar
+
+# ambiguous balanced brackets, a dense chart for any accepted word
+GRAMMAR = ["S -> SS | aSb | ab"]
+
+
+def dyck_word(length, rng):
+    word = []
+    depth = 0
+    for i in range(length):
+        remaining = length - i
+        if depth > 0 and (depth == remaining or rng.random() < 0.5):
+            word.append("b")
+            depth -= 1
+        else:
+            word.append("a")
+            depth += 1
+    return [Terminal(t) for t in word]
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Valiant recognizer crossover benchmark")
+    arg_parser.add_argument("--max-length", type=int, default=512)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    # the classic parser is skipped for longer words once a run exceeds this
+    arg_parser.add_argument("--classic-limit", type=float, default=20.0)
+    args = arg_parser.parse_args()
+
+    cfg = load_grammar(GRAMMAR)
+    transform_to_CNF(cfg)
+    compiled = CompiledCNF(cfg)
+    rng = random.Random(args.seed)
+
+    print("%8s %12s %12s %12s" % ("length", "classic", "bitset", "valiant"))
+    crossover = dict()
+    length = 8
+    classic_done = False
+    while length <= args.max_length:
+        word = dyck_word(length, rng)
+        times = dict()
+        if not classic_done:
+            times["classic"] = best_time(lambda: cyk_parser(cfg, word), args.repeat)
+            classic_done = times["classic"] > args.classic_limit
+        times["bitset"] = best_time(lambda: compiled.parse(word), args.repeat)
+        times["valiant"] = best_time(lambda: compiled.parse(word, backend="valiant"), args.repeat)
+        for other in ("classic", "bitset"):
+            if other in times and times["valiant"] < times[other]:
+                crossover.setdefault(other, length)
+
+        print("%8d %12s %12.4f %12.4f" % (length, "%.4f" % times["classic"] if "classic" in times else "-",
+                                          times["bitset"], times["valiant"]))
+        length *= 2
+
+    for other in ("classic", "bitset"):
+        if other in crossover:
+            print("valiant is faster than %s from length %d on" % (other, crossover[other]))
+        else:
+            print("no crossover against %s up to length %d" % (other, args.max_length))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
+from collections import namedtuple, OrderedDict
 import itertools
+import threading
+from types import MappingProxyType
+
+from src.bitset import iter_bits
+from src.cfg import NonTerminal, Terminal
+from src.cyk_numpy import NumpyTables, numpy_parse
+from src.parse_forest import build_forest
+from src.valiant import valiant_parse
+import src.profiling
 
 
 def rhs_to_lhs_mapping(cfg):
@@ -14,8 +24,15 @@ def rhs_to_lhs_mapping(cfg):
     return ret
 
 
-def cyk_parser(cfg, word):
+# returns whether the CNF grammar accepts 'word', or the ParseForest of its
+# derivations (None if rejected) when 'forest' is set
+def cyk_parser(cfg, word, forest=False):
+    if forest:
+        return CompiledCNF(cfg).parse_forest(word)
+
     rhs_mapping = rhs_to_lhs_mapping(cfg)
+    profiled = src.profiling.enabled()
+    lookups = 0
     subword_mapping = dict()
     length = len(word)
     for term in word:
@@ -34,10 +51,400 @@ def cyk_parser(cfg, word):
                     lhs = subword_mapping.get(tuple(subword[:k]))
                     rhs = subword_mapping.get(tuple(subword[k:]))
                     if lhs is not None and rhs is not None:
+                        if profiled:
+                            lookups += len(lhs) * len(rhs)
                         for prod in itertools.product(lhs, rhs):
                             rule = rhs_mapping.get(prod)
                             if rule:
                                 prod_rules = prod_rules.union(rule)
                 subword_mapping.update({subword_tuple: prod_rules})
 
+    if profiled:
+        src.profiling.count("cyk.chart_cells", len(subword_mapping))
+        src.profiling.count("cyk.rule_lookups", lookups)
+
     return cfg.start_var in subword_mapping.get(tuple(word), {})
+
+
+# assigns every non-terminal of a CNF grammar a bit position, the start
+# variable always gets bit 0 so acceptance is a single bit test
+def number_non_terminals(cfg):
+    ids = dict()
+    if cfg.start_var is not None:
+        ids[cfg.start_var] = 0
+    for var in cfg.non_terminals:
+        if var not in ids:
+            ids[var] = len(ids)
+    return ids
+
+
+# maps every terminal to the bitmask of non-terminals that produce it
+def terminal_masks(cfg, ids):
+    ret = dict()
+    for key, rules in cfg.production_rules.items():
+        for rule in rules:
+            if len(rule.rhs) == 1 and isinstance(rule.rhs[0], Terminal):
+                ret[rule.rhs[0]] = ret.get(rule.rhs[0], 0) | (1 << ids[key])
+    return ret
+
+
+# indexes the binary rules A -> BC by the id of B, every entry holds the bit
+# of C and the bitmask of all A's that have a rule with that (B, C) pair
+def binary_rule_index(cfg, ids):
+    pairs = dict()
+    for key, rules in cfg.production_rules.items():
+        for rule in rules:
+            if len(rule.rhs) == 2 and isinstance(rule.rhs[0], NonTerminal) \
+                    and isinstance(rule.rhs[1], NonTerminal):
+                pair = (ids[rule.rhs[0]], ids[rule.rhs[1]])
+                pairs[pair] = pairs.get(pair, 0) | (1 << ids[key])
+
+    ret = [[] for _ in range(len(ids))]
+    for (left, right), lhs_mask in pairs.items():
+        ret[left].append((1 << right, lhs_mask))
+    return ret
+
+
+# the bitmask of all A with A -> BC, B in 'left' and C in 'right'
+def _combine(by_left, left, right):
+    ret = 0
+    for b in iter_bits(left):
+        for right_bit, lhs_mask in by_left[b]:
+            if right & right_bit:
+                ret |= lhs_mask
+    return ret
+
+
+# fills the chart column for the span ending at 'end', chart[j][i] holds the
+# bitmask of non-terminals deriving word[i:j]. Only the cells starting at or
+# before 'last_start' are recomputed.
+def _fill_column(chart, by_left, left_any, end, last_start=None):
+    if last_start is None or last_start > end - 2:
+        last_start = end - 2
+    column = chart[end]
+    for start in range(last_start, -1, -1):
+        cell = 0
+        for split in range(start + 1, end):
+            left = chart[split][start] & left_any
+            if left:
+                right = column[split]
+                if right:
+                    cell |= _combine(by_left, left, right)
+        column[start] = cell
+
+
+# same as _fill_column, but the cells of spans up to cache.max_span tokens are
+# looked up in and stored to a SpanCache keyed by the tokens of their span.
+# Longer spans rarely repeat, they are computed as usual and never cached, so
+# they neither pay for building their key nor push short fragments out.
+def _fill_column_cached(chart, by_left, left_any, end, word, cache):
+    column = chart[end]
+    last_uncached = end - cache.max_span - 1
+    for start in range(end - 2, max(last_uncached, -1), -1):
+        span = tuple(word[start:end])
+        cell = cache.get(span)
+        if cell is None:
+            cell = 0
+            for split in range(start + 1, end):
+                left = chart[split][start] & left_any
+                if left:
+                    right = column[split]
+                    if right:
+                        cell |= _combine(by_left, left, right)
+            cache.put(span, cell)
+        column[start] = cell
+    if last_uncached >= 0:
+        _fill_column(chart, by_left, left_any, end, last_uncached)
+
+
+def _bitset_chart(term_masks, by_left, left_any, word, cache=None):
+    chart = [None]
+    for end in range(1, len(word) + 1):
+        chart.append([0] * end)
+        chart[end][end - 1] = term_masks.get(word[end - 1], 0)
+        if cache is None:
+            _fill_column(chart, by_left, left_any, end)
+        else:
+            _fill_column_cached(chart, by_left, left_any, end, word, cache)
+    return chart
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class SpanCache:
+    """
+    Class to encapsulate a bounded least recently used cache mapping a span of
+    tokens to the bitmask of non-terminals deriving it
+
+    maxsize = the maximal number of cached spans
+    max_span = the length of the longest span that is cached
+    hits, misses = the number of lookups that were found and not found
+
+    A lock guards every access, so threads parsing with one CompiledCNF can
+    share its cache.
+    """
+
+    def __init__(self, maxsize, max_span=8):
+        self.maxsize = maxsize
+        self.max_span = max_span
+        self.hits = 0
+        self.misses = 0
+        self._spans = OrderedDict()
+        self._lock = threading.Lock()
+
+    # locks cannot be pickled, a copy sent to a worker process gets its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, span):
+        with self._lock:
+            cell = self._spans.get(span)
+            if cell is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._spans.move_to_end(span)
+            return cell
+
+    def put(self, span, cell):
+        with self._lock:
+            self._spans[span] = cell
+            if len(self._spans) > self.maxsize:
+                self._spans.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._spans))
+
+    def clear(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self._spans.clear()
+
+
+class CompiledCNF:
+    """
+    Class to encapsulate the frozen lookup tables of a CNF grammar, built once
+    so that many words can be parsed without rebuilding them
+
+    non_terminals = a tuple of the non-terminals, indexed by their id
+    ids = a mapping of NonTerminal to its id (bit position in the chart cells)
+    terminal_masks = a mapping of Terminal to the bitmask of non-terminals producing it
+    pair_masks = a mapping of (B, C) id pairs to the bitmask of all A with A -> BC
+    pairs_by_lhs = a tuple holding, for every id A, the (B, C) id pairs of A's binary rules
+    start_id = the id of the starting symbol, None if the CFG has none
+    span_cache = a SpanCache shared by all parses when 'cache_size' is given, None otherwise.
+                 It holds spans of at most 'max_span' tokens.
+    """
+
+    def __init__(self, cfg, cache_size=None, max_span=8):
+        ids = number_non_terminals(cfg)
+        by_left = binary_rule_index(cfg, ids)
+        self.non_terminals = tuple(sorted(ids, key=ids.get))
+        self.ids = MappingProxyType(ids)
+        self.terminal_masks = MappingProxyType(terminal_masks(cfg, ids))
+        self.pair_masks = MappingProxyType({(b, c_bit.bit_length() - 1): lhs_mask
+                                            for b, entries in enumerate(by_left)
+                                            for c_bit, lhs_mask in entries})
+        pairs_by_lhs = [[] for _ in range(len(ids))]
+        for pair, lhs_mask in self.pair_masks.items():
+            for a in iter_bits(lhs_mask):
+                pairs_by_lhs[a].append(pair)
+        self.pairs_by_lhs = tuple(tuple(pairs) for pairs in pairs_by_lhs)
+        self.start_id = ids.get(cfg.start_var)
+        self._prefix_tables = None
+        self._numpy_tables = None
+        self.span_cache = None if cache_size is None else SpanCache(cache_size, max_span)
+        self._by_left = tuple(tuple(entries) for entries in by_left)
+        self._left_any = 0
+        for b, entries in enumerate(by_left):
+            if entries:
+                self._left_any |= 1 << b
+
+    # the mapping proxies cannot be pickled, which is needed to ship the
+    # tables to worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("ids", "terminal_masks", "pair_masks"):
+            state[name] = dict(state[name])
+        return state
+
+    def __setstate__(self, state):
+        for name in ("ids", "terminal_masks", "pair_masks"):
+            state[name] = MappingProxyType(state[name])
+        self.__dict__.update(state)
+
+    def chart(self, word):
+        return _bitset_chart(self.terminal_masks, self._by_left, self._left_any, word, self.span_cache)
+
+    # the bitmask of all A with A -> BC, B in the bitmask 'left' and C in 'right'
+    def combine(self, left, right):
+        return _combine(self._by_left, left, right)
+
+    # fills chart[end][start] for every start before end - 1 from the shorter
+    # spans, chart[j][i] holding the bitmask of non-terminals deriving
+    # word[i:j]. The cell chart[end][end - 1] must already be set.
+    def fill_column(self, chart, end):
+        _fill_column(chart, self._by_left, self._left_any, end)
+
+    # 'backend' selects the chart representation: "bitset" (int bitmask cells),
+    # "numpy" (boolean arrays filled one span length at a time) or "valiant"
+    # (divide and conquer over boolean matrix products, for very long words)
+    def parse(self, word, backend="bitset"):
+        if backend == "numpy":
+            if self._numpy_tables is None:
+                self._numpy_tables = NumpyTables(self)
+            return numpy_parse(self, self._numpy_tables, word)
+        elif backend == "valiant":
+            return valiant_parse(self, word)
+        elif backend != "bitset":
+            raise ValueError("Unknown CYK backend: " + str(backend))
+
+        if len(word) == 0 or self.start_id is None:
+            return False
+        return self.chart(word)[len(word)][0] >> self.start_id & 1 == 1
+
+    def parse_many(self, words, backend="bitset"):
+        return [self.parse(word, backend) for word in words]
+
+    def cache_info(self):
+        return None if self.span_cache is None else self.span_cache.info()
+
+    # returns the bitmask of productive non-terminals and, for every id B, the
+    # bitmask of all X that derive B Y1 .. Yk with productive Y's through
+    # binary rules (B itself included). Computed on first use.
+    def prefix_tables(self):
+        if self._prefix_tables is not None:
+            return self._prefix_tables
+
+        productive = 0
+        for mask in self.terminal_masks.values():
+            productive |= mask
+        changed = True
+        while changed:
+            changed = False
+            for (b, c), lhs_mask in self.pair_masks.items():
+                if productive >> b & 1 and productive >> c & 1 and lhs_mask & ~productive:
+                    productive |= lhs_mask
+                    changed = True
+
+        parents = [0] * len(self.non_terminals)
+        for (b, c), lhs_mask in self.pair_masks.items():
+            if productive >> c & 1:
+                parents[b] |= lhs_mask
+
+        closures = []
+        for b in range(len(self.non_terminals)):
+            closure = 1 << b
+            worklist = [b]
+            while worklist:
+                new = parents[worklist.pop()] & ~closure
+                closure |= new
+                worklist.extend(iter_bits(new))
+            closures.append(closure)
+
+        self._prefix_tables = (productive, tuple(closures))
+        return self._prefix_tables
+
+    # returns the ParseForest of all derivations of 'word', None if it is rejected
+    def parse_forest(self, word):
+        if len(word) == 0 or self.start_id is None:
+            return None
+        return build_forest(self, word, self.chart(word))
+
+
+class IncrementalCYK:
+    """
+    Class to encapsulate a CYK chart that is kept up to date while the word is
+    edited. Appending a token only fills the new chart column, replacing the
+    token at position i only recomputes the cells of spans containing i.
+
+    compiled = the CompiledCNF the word is checked against
+    word = the current list of tokens, it must only be changed through the methods
+    """
+
+    def __init__(self, grammar, word=()):
+        self.compiled = compile_cnf(grammar)
+        self.word = []
+        self._chart = [None]
+        self._viable = None
+        for token in word:
+            self.append(token)
+
+    def __len__(self):
+        return len(self.word)
+
+    def append(self, token):
+        self.word.append(token)
+        end = len(self.word)
+        self._chart.append([0] * end)
+        self._chart[end][end - 1] = self.compiled.terminal_masks.get(token, 0)
+        _fill_column(self._chart, self.compiled._by_left, self.compiled._left_any, end)
+        self._viable = None
+
+    def pop(self):
+        self._chart.pop()
+        self._viable = None
+        return self.word.pop()
+
+    def replace(self, i, token):
+        self.word[i] = token
+        self._chart[i + 1][i] = self.compiled.terminal_masks.get(token, 0)
+        for end in range(i + 1, len(self.word) + 1):
+            _fill_column(self._chart, self.compiled._by_left, self.compiled._left_any, end, i)
+        self._viable = None
+
+    def accepts(self):
+        start_id = self.compiled.start_id
+        if len(self.word) == 0 or start_id is None:
+            return False
+        return self._chart[len(self.word)][0] >> start_id & 1 == 1
+
+    # returns whether some word of the language starts with the current word.
+    # For every position i the bitmask of non-terminals deriving word[i:] followed
+    # by any (possibly empty) suffix is computed from the chart, back to front.
+    def is_viable_prefix(self):
+        start_id = self.compiled.start_id
+        if start_id is None:
+            return False
+        if self._viable is not None:
+            return self._viable
+
+        productive, closures = self.compiled.prefix_tables()
+        by_left = self.compiled._by_left
+        left_any = self.compiled._left_any
+        length = len(self.word)
+        last_column = self._chart[length] if length > 0 else None
+        prefixes = [0] * (length + 1)
+        prefixes[length] = productive
+        for start in range(length - 1, -1, -1):
+            mask = last_column[start]
+            for split in range(start + 1, length):
+                left = self._chart[split][start] & left_any
+                if left and prefixes[split]:
+                    mask |= _combine(by_left, left, prefixes[split])
+            for b in iter_bits(mask):
+                mask |= closures[b]
+            prefixes[start] = mask
+
+        self._viable = prefixes[0] >> start_id & 1 == 1
+        return self._viable
+
+
+# returns 'grammar' if it already is compiled, compiles the CFG otherwise
+def compile_cnf(grammar):
+    if isinstance(grammar, CompiledCNF):
+        return grammar
+    return CompiledCNF(grammar)
+
+
+def bitset_cyk_parser(cfg, word):
+    return CompiledCNF(cfg).parse(word)
@@ -0,0 +1,144 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import math
+import os
+
+from src.batch_parser import init_worker, parse_chunk
+from src.CYK_parser import compile_cnf
+
+
+class AsyncRecognizer:
+    """
+    Class to encapsulate an asyncio front end to the CYK recognizer of a CNF
+    grammar. Concurrent recognize calls are put on a bounded queue, a batcher
+    task collects them into micro-batches and runs every batch on a worker
+    pool, so the event loop never runs a parse itself. A full queue makes
+    recognize wait, which pushes back on the callers.
+
+    compiled = the CompiledCNF of the grammar
+    workers = the size of the worker pool
+    max_batch = the maximal number of words per batch
+    max_delay = seconds the batcher waits for more words before sending a batch
+    max_queue = the capacity of the request queue
+    use_processes = whether the pool runs processes, threads share the GIL with
+                    the event loop, so they only suit short words
+    """
+
+    def __init__(self, cfg, workers=None, max_batch=256, max_delay=0.002, max_queue=4096,
+                 use_processes=True, latency_window=10000):
+        self.compiled = compile_cnf(cfg)
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        self._latencies = deque(maxlen=latency_window)
+        self._queue = None
+        self._executor = None
+        self._batcher = None
+        self._in_flight = set()
+        self._slots = None
+
+    async def start(self):
+        if self._batcher is not None:
+            return
+        if self.use_processes:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                 initargs=(self.compiled,))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # at most two batches per worker are in flight, the rest wait in the queue
+        self._slots = asyncio.Semaphore(2 * self.workers)
+        self._batcher = asyncio.get_running_loop().create_task(self._run_batcher())
+
+    # waits for every queued word to be answered, then stops the pool
+    async def close(self):
+        if self._batcher is None:
+            return
+        await self._queue.join()
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight)
+        executor = self._executor
+        self._batcher = None
+        self._executor = None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    async def recognize(self, word):
+        if self._batcher is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((list(word), future, loop.time()))
+        return await future
+
+    async def _run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            task = loop.create_task(self._run_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        words = [word for word, future, start in batch]
+        try:
+            if self.use_processes:
+                results = await loop.run_in_executor(self._executor, parse_chunk, words)
+            else:
+                results = await loop.run_in_executor(self._executor, self.compiled.parse_many, words)
+        except Exception as error:
+            for word, future, start in batch:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            end = loop.time()
+            for (word, future, start), result in zip(batch, results):
+                self._latencies.append(end - start)
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+            for _ in batch:
+                self._queue.task_done()
+
+    # the latency of the most recent requests at the given percentiles, as a
+    # mapping of percentile to seconds, nearest rank
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {percentile: None for percentile in percentiles}
+        ret = dict()
+        for percentile in percentiles:
+            rank = math.ceil(percentile * len(latencies) / 100)
+            ret[percentile] = latencies[min(len(latencies) - 1, max(0, rank - 1))]
+        return ret
@@ -0,0 +1,53 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+
+from src.CYK_parser import compile_cnf
+
+# the compiled grammar of a worker process, set once by the initializer
+_worker_grammar = None
+
+
+# the initializer of a worker process parsing with the CompiledCNF 'compiled',
+# shared by parse_batch and the process pool of AsyncRecognizer
+def init_worker(compiled):
+    global _worker_grammar
+    _worker_grammar = compiled
+
+
+# parses a chunk of words in a worker process set up by init_worker
+def parse_chunk(words):
+    return _worker_grammar.parse_many(words)
+
+
+def _chunks(words, chunk_size):
+    it = iter(words)
+    while True:
+        chunk = list(itertools.islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# tests every word of 'words' for membership in the language of the CNF grammar
+# 'cfg' and yields the results in input order. The compiled grammar is sent to
+# every worker once, only chunks of words are sent per task. At most
+# 'max_pending' chunks are in flight, so 'words' may be an unbounded iterator.
+def parse_batch(cfg, words, workers=None, chunk_size=256, max_pending=None):
+    compiled = compile_cnf(cfg)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(compiled,)) as executor:
+        pending = deque()
+        for chunk in _chunks(words, chunk_size):
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(parse_chunk, chunk))
+
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,10 @@
+# helpers for non-terminal sets stored as int bitmasks, bit i standing for the
+# non-terminal with id i
+
+
+# yields the positions of the bits set in 'mask'
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
@@ -1,12 +1,29 @@
-class Terminal:
-    def __init__(self, t):
-        self.value = t
+class _Symbol:
+    """
+    Base class of the grammar symbols. Symbols are interned: there is exactly
+    one object per class and name, so equality and hashing are by identity.
+    Symbols are immutable.
 
-    def __hash__(self):
-        return hash(self.value)
+    value = the name of the symbol
+    """
 
-    def __eq__(self, other):
-        return isinstance(other, Terminal) and other.value == self.value
+    __slots__ = ("value",)
+
+    def __new__(cls, value):
+        existing = cls._interned.get(value)
+        if existing is None:
+            # setdefault is atomic, so threads racing to create a symbol all get the same one
+            candidate = object.__new__(cls)
+            object.__setattr__(candidate, "value", value)
+            existing = cls._interned.setdefault(value, candidate)
+        return existing
+
+    def __setattr__(self, name, value):
+        raise AttributeError(type(self).__name__ + " is immutable")
+
+    # unpickling and deep copies go through the constructor, so they are interned too
+    def __reduce__(self):
+        return type(self), (self.value,)
 
     def __str__(self):
         return self.value
@@ -15,32 +32,27 @@ class Terminal:
         return str(self)
 
 
-class NonTerminal:
-    def __init__(self, n):
-        self.value = n
-
-    def __hash__(self):
-        return hash(self.value)
+class Terminal(_Symbol):
+    __slots__ = ()
+    _interned = dict()
 
-    def __eq__(self, other):
-        return isinstance(other, NonTerminal) and other.value == self.value
 
-    def __str__(self):
-        return self.value
-
-    def __repr__(self):
-        return str(self)
+class NonTerminal(_Symbol):
+    __slots__ = ()
+    _interned = dict()
 
 
 class Lambda:
-    def __init__(self):
-        pass
+    __slots__ = ()
+    _instance = None
 
-    def __hash__(self):
-        return 0
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = object.__new__(cls)
+        return cls._instance
 
-    def __eq__(self, other):
-        return isinstance(other, Lambda)
+    def __reduce__(self):
+        return Lambda, ()
 
     def __str__(self):
         return "lambda"
@@ -51,16 +63,22 @@ class Lambda:
 
 class Rule:
     """
-    Class to encapsulate rules
+    Class to encapsulate rules, rules are immutable and their hash is computed once
 
-    lhs = Terminal symbol on lhs
-    rhs = string of lhs replacement rule
-    rhs_split = tokens of type Terminal, NonTerminal, Lambda for replacement rule
+    lhs = NonTerminal symbol on lhs
+    rhs = tuple of tokens of type Terminal, NonTerminal, Lambda for replacement rule
     """
 
+    __slots__ = ("lhs", "rhs", "_hash")
+
     def __init__(self, lhs, rhs):
-        self.lhs = lhs
-        self.rhs = rhs
+        rhs = tuple(rhs)
+        object.__setattr__(self, "lhs", lhs)
+        object.__setattr__(self, "rhs", rhs)
+        object.__setattr__(self, "_hash", hash((lhs, rhs)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Rule is immutable")
 
     def get_rhs_string(self):
         ret = ""
@@ -69,10 +87,16 @@ class Rule:
         return ret
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
 
+    # symbols are interned, so the lhs is compared by identity and the rhs
+    # tuple comparison only does identity checks
     def __eq__(self, other):
-        return isinstance(other, Rule) and str(other) == str(self)
+        return self is other or (isinstance(other, Rule) and self._hash == other._hash
+                                 and self.lhs is other.lhs and self.rhs == other.rhs)
+
+    def __reduce__(self):
+        return Rule, (self.lhs, self.rhs)
 
     def __str__(self):
         return str(self.lhs) + " -> " + Rule.get_rhs_string(self)
@@ -90,6 +114,9 @@ class CFG:
     production_rules = a mapping of Terminal to a set of production rules
     start_var = the starting symbol of the CFG
 
+    Grammars made by copy share their rule sets copy-on-write: _owned_rules and
+    _owned_refs hold the keys whose sets this grammar may modify, None if it
+    owns all of them.
     """
 
     def __init__(self):
@@ -98,17 +125,51 @@ class CFG:
         self._refs = dict()
         self.production_rules = dict()
         self.start_var = None
+        self._owned_rules = None
+        self._owned_refs = None
+
+    # returns a grammar equal to this one that shares every rule set with it,
+    # only the mappings and the symbol sets are copied. A set is copied by
+    # whichever grammar modifies it first, so unchanged productions are never
+    # allocated twice.
+    def copy(self):
+        ret = CFG()
+        ret.terminals = set(self.terminals)
+        ret.non_terminals = set(self.non_terminals)
+        ret._refs = dict(self._refs)
+        ret.production_rules = dict(self.production_rules)
+        ret.start_var = self.start_var
+        ret._owned_rules = set()
+        ret._owned_refs = set()
+        self._owned_rules = set()
+        self._owned_refs = set()
+        return ret
+
+    # the set under 'key' in 'table', copied first if it is shared
+    @staticmethod
+    def _writable(table, owned, key):
+        values = table.get(key)
+        if values is not None and owned is not None and key not in owned:
+            values = table[key] = set(values)
+            owned.add(key)
+        return values
+
+    @staticmethod
+    def _insert(table, owned, key, value):
+        values = CFG._writable(table, owned, key)
+        if values is None:
+            table[key] = {value}
+            if owned is not None:
+                owned.add(key)
+        else:
+            values.add(value)
 
     def _add_refs(self, rule):
         if rule.rhs[0] == Lambda():
             return
 
         for var in rule.rhs:
-            var_refs = self._refs.get(var)
-            if var_refs is None:
-                self._refs.update({var: {rule}})
-            else:
-                var_refs.add(rule)
+            CFG._insert(self._refs, self._owned_refs, var, rule)
 
     def _remove_refs(self, rule):
         if rule.rhs[0] == Lambda():
@@ -116,7 +177,8 @@ class CFG:
 
         for var in rule.rhs:
             var_refs = self._refs.get(var)
-            if var_refs is not None:
+            if var_refs is not None and rule in var_refs:
+                var_refs = CFG._writable(self._refs, self._owned_refs, var)
                 var_refs.discard(rule)
                 if len(var_refs) == 0:
                     self._refs.pop(var)
@@ -135,11 +197,7 @@ class CFG:
         if len(self.production_rules) == 0:
             self.start_var = rule.lhs
 
-        existing = self.production_rules.get(rule.lhs)
-        if existing is None:
-            self.production_rules.update({rule.lhs: {rule}})
-        else:
-            existing.add(rule)
+        CFG._insert(self.production_rules, self._owned_rules, rule.lhs, rule)
 
         self.non_terminals.add(rule.lhs)
         if not isinstance(rule.rhs[0], Lambda):
@@ -150,16 +208,40 @@ class CFG:
                     self.non_terminals.add(var)
         self._add_refs(rule)
 
+    # bulk insertion of an iterable of rules, the symbol sets and the _refs
+    # bookkeeping are updated once all rules are inserted
+    def add_rules(self, rules):
+        added = []
+        symbols = set()
+        try:
+            for rule in rules:
+                if len(rule.rhs) == 0:
+                    continue
+
+                if len(self.production_rules) == 0:
+                    self.start_var = rule.lhs
+                CFG._insert(self.production_rules, self._owned_rules, rule.lhs, rule)
+                symbols.add(rule.lhs)
+                symbols.update(rule.rhs)
+                added.append(rule)
+        finally:
+            # 'rules' may be a generator that raises, the rules inserted so far
+            # still get their symbols and references
+            for var in symbols:
+                if isinstance(var, NonTerminal):
+                    self.non_terminals.add(var)
+                elif isinstance(var, Terminal):
+                    self.terminals.add(var)
+
+            for rule in added:
+                self._add_refs(rule)
+
     def duplicate_rule(self, rule, new_lhs):
         if len(rule.rhs) == 0:
             return
 
         new_rule = Rule(new_lhs, rule.rhs)
-        existing = self.production_rules.get(new_lhs)
-        if existing is None:
-            self.production_rules.update({new_lhs: new_rule})
-        else:
-            existing.add(new_rule)
+        CFG._insert(self.production_rules, self._owned_rules, new_lhs, new_rule)
         self.non_terminals.add(new_lhs)
         self._add_refs(new_rule)
 
@@ -167,10 +249,11 @@ class CFG:
         if len(rule.rhs) == 0:
             return
 
-        rules = self.production_rules.get(rule.lhs)
-        rules.discard(rule)
-        if len(rules) == 0:
-            self.production_rules.pop(rule.lhs)
+        if rule in self.production_rules.get(rule.lhs, ()):
+            rules = CFG._writable(self.production_rules, self._owned_rules, rule.lhs)
+            rules.discard(rule)
+            if len(rules) == 0:
+                self.production_rules.pop(rule.lhs)
         self._remove_refs(rule)
 
     def __str__(self):
@@ -1,63 +1,127 @@
+from collections import namedtuple
 from src.cfg import *
-import copy
+import itertools
+
+# Every pass modifies 'cfg' and returns it. With in_place=False it works on a
+# copy-on-write CFG.copy instead, which shares all productions the pass does
+# not change with 'cfg', and 'cfg' itself is left untouched.
+
+
+# worklist fixpoint: 'pending' maps every candidate rule to the number of
+# distinct non-terminals on its rhs that are not resolved yet. Resolving a
+# variable only visits the rules referencing it through cfg._refs, a rule's
+# lhs is resolved once its counter drops to zero.
+def _propagate(cfg, resolved, worklist, pending):
+    while worklist:
+        var = worklist.pop()
+        for rule in cfg._refs.get(var, ()):
+            count = pending.get(rule)
+            if count is None:
+                continue
+            pending[rule] = count - 1
+            if count == 1 and rule.lhs not in resolved:
+                resolved.add(rule.lhs)
+                worklist.append(rule.lhs)
 
+    return resolved
 
-def get_erasable_vars(cfg):
-    erasable = set()
 
-    changed = True
-    while changed:
-        changed = False
-        for key, rules in cfg.production_rules.items():
-            if key in erasable:
-                continue
+def _count_non_terminals(rule):
+    return len({var for var in rule.rhs if isinstance(var, NonTerminal)})
+
 
-            for rule in rules:
-                if isinstance(rule.rhs[0], Lambda):
+def get_erasable_vars(cfg):
+    erasable = set()
+    worklist = []
+    pending = dict()
+    for key, rules in cfg.production_rules.items():
+        for rule in rules:
+            if isinstance(rule.rhs[0], Lambda):
+                if key not in erasable:
                     erasable.add(key)
-                    changed = True
-                else:
-                    can_erase = True
-                    for var in rule.rhs:
-                        if isinstance(var, Terminal) or var not in erasable:
-                            can_erase = False
-                            break
-                    if can_erase:
-                        erasable.add(key)
-                        changed = True
+                    worklist.append(key)
+            elif not any(isinstance(var, Terminal) for var in rule.rhs):
+                pending[rule] = _count_non_terminals(rule)
+
+    return _propagate(cfg, erasable, worklist, pending)
+
+
+# yields the rhs of every variant of 'rule' that drops a non-empty subset of
+# its erasable variables, each subset exactly once. The variants share the
+# symbol objects of the original rule. A variant dropping every variable would
+# be a lambda rule and is skipped.
+def _lambda_variants(erasable, rule):
+    options = []
+    for var in rule.rhs:
+        if var in erasable:
+            options.append(((var,), ()))
+        else:
+            options.append(((var,),))
+
+    variants = itertools.product(*options)
+    next(variants)  # the first variant keeps every variable, it is the rule itself
+    for variant in variants:
+        rhs = list(itertools.chain.from_iterable(variant))
+        if len(rhs) > 0:
+            yield rhs
+
+
+# returns a fresh non-terminal name with the given prefix, 'taken' holds the
+# names in use and is updated
+def _fresh_name(prefix, taken):
+    i = len(taken)
+    while prefix + str(i) in taken:
+        i += 1
+    taken.add(prefix + str(i))
+    return prefix + str(i)
+
+
+# splits every rule with more than two variables on its rhs into a chain of
+# rules with two variables each. The rules are split in sorted order, so the
+# same grammar always gets the same names.
+def binarize_rules(cfg, prefix="_BIN", in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
+
+    taken = {var.value for var in cfg.non_terminals}
+    long_rules = sorted((rule for rules in cfg.production_rules.values() for rule in rules if len(rule.rhs) > 2),
+                        key=str)
+    for rule in long_rules:
+        cfg.remove_rule(rule)
+        lhs = rule.lhs
+        for var in rule.rhs[:-2]:
+            new_non = NonTerminal(_fresh_name(prefix, taken))
+            cfg.add_rule(Rule(lhs, [var, new_non]))
+            lhs = new_non
+        cfg.add_rule(Rule(lhs, list(rule.rhs[-2:])))
 
-    return erasable
+    return cfg
 
 
-# for every erasable variable in a rule, it adds a copy of the rule
-# sans the erasable variable to 'to_add'
-def _remove_lambdas_help(erasable, to_add, rule):
-    for i in range(len(rule.rhs)):
-        if rule.rhs[i] in erasable and len(rule.rhs) > 1:
-            temp = copy.deepcopy(rule.rhs)
-            temp.pop(i)
-            to_add.append(Rule(rule.lhs, temp))
+# remove all lambda production rules, with 'binarize' long rules are split
+# first so a rule has at most 3 variants instead of 2^(erasable variables)
+def remove_lambdas(cfg, binarize=False, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
 
+    if binarize:
+        binarize_rules(cfg)
 
-# remove all lambda production rules
-def remove_lambdas(cfg):
     erasable = get_erasable_vars(cfg)
+    to_add = []
     for key, rules in cfg.production_rules.items():
-        to_add = []
-        count = 0
         for rule in rules:
-            _remove_lambdas_help(erasable, to_add, rule)
-
-            while count < len(to_add):
-                _remove_lambdas_help(erasable, to_add, to_add[count])
-                count += 1
+            if any(var in erasable for var in rule.rhs):
+                to_add.extend(Rule(key, rhs) for rhs in _lambda_variants(erasable, rule))
 
-        for add in to_add:
-            cfg.add_rule(add)
+    for add in to_add:
+        cfg.add_rule(add)
 
     for erase in erasable:
         cfg.remove_rule(Rule(erase, [Lambda()]))
 
+    return cfg
+
 
 # returns a set of all unit production rules
 def get_unit_rules(cfg):
@@ -74,54 +138,124 @@ def _is_unit_rule(rule):
     return len(rule.rhs) == 1 and isinstance(rule.rhs[0], NonTerminal)
 
 
-def remove_unit_rules(cfg):
-    unit_rules = get_unit_rules(cfg)
+# the unit graph: an edge A -> B for every unit rule A -> B with A != B
+def _unit_graph(cfg):
+    graph = dict()
     for key, rules in cfg.production_rules.items():
-        added_rules = {key}
-        worklist = []
-        for rule in rules:
-            if _is_unit_rule(rule) and rule.rhs[0] not in added_rules:
-                added_rules.add(rule.rhs[0])
-                worklist.append(rule.rhs[0])
+        targets = [rule.rhs[0] for rule in rules if _is_unit_rule(rule) and rule.rhs[0] is not key]
+        if targets:
+            graph[key] = targets
+
+    return graph
+
+
+# iterative Tarjan: returns the strongly connected components of 'graph' as
+# lists of vertices, every component comes after all components it reaches
+def _strongly_connected(graph):
+    index = dict()
+    low = dict()
+    stack = []
+    on_stack = set()
+    components = []
+    for root in graph:
+        if root in index:
+            continue
+
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph.get(root, ())))]
+        while work:
+            var, successors = work[-1]
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = low[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(graph.get(succ, ()))))
+                    break
+                if succ in on_stack:
+                    low[var] = min(low[var], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[var])
+                if low[var] == index[var]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member is var:
+                            break
+                    components.append(component)
+
+    return components
 
-        for var in worklist:
-            var_rules = cfg.production_rules.get(var)
-            if var_rules is None:
-                continue
 
-            for rule in var_rules:
-                if _is_unit_rule(rule) and rule.rhs[0] not in added_rules:
-                    added_rules.add(rule.rhs[0])
-                    worklist.append(rule.rhs[0])
-                elif not _is_unit_rule(rule):
-                    cfg.duplicate_rule(rule, key)
+# for every A -> B unit rule chain A =>* B, A gets a copy of every non-unit
+# rule of B. The unit graph is condensed into its strongly connected
+# components first: all members of a component derive each other, so they
+# share one set of rhs, built once from the component's own non-unit rules
+# and the sets of the components it reaches.
+def remove_unit_rules(cfg, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
+
+    unit_rules = get_unit_rules(cfg)
+    graph = _unit_graph(cfg)
+    component_of = dict()
+    reachable_rhs = []
+    for component in _strongly_connected(graph):
+        number = len(reachable_rhs)
+        rhs_set = set()
+        for var in component:
+            component_of[var] = number
+            for rule in cfg.production_rules.get(var, ()):
+                if not _is_unit_rule(rule):
+                    rhs_set.add(rule.rhs)
+        for var in component:
+            for succ in graph.get(var, ()):
+                other = component_of[succ]
+                if other != number:
+                    rhs_set |= reachable_rhs[other]
+        reachable_rhs.append(rhs_set)
+
+    to_add = []
+    for var, number in component_of.items():
+        if var not in graph:
+            continue
+        own = {rule.rhs for rule in cfg.production_rules[var]}
+        to_add.extend(Rule(var, rhs) for rhs in reachable_rhs[number] if rhs not in own)
 
     for rule in unit_rules:
         cfg.remove_rule(rule)
+    cfg.add_rules(to_add)
+
+    return cfg
 
 
 def get_productive_vars(cfg):
     productives = set()
-    changed = True
-    while changed:
-        changed = False
-        for key, rules in cfg.production_rules.items():
-            for rule in rules:
-                productive = True
-                for var in rule.rhs:
-                    if isinstance(var, NonTerminal) and var not in productives:
-                        productive = False
-                        break
-
-                if productive and key not in productives:
-                    productives.add(key)
-                    changed = True
-                    break
+    worklist = []
+    pending = dict()
+    for key, rules in cfg.production_rules.items():
+        for rule in rules:
+            count = _count_non_terminals(rule)
+            if count > 0:
+                pending[rule] = count
+            elif key not in productives:
+                productives.add(key)
+                worklist.append(key)
+
+    return _propagate(cfg, productives, worklist, pending)
 
-    return productives
 
+def remove_nonproductive_rules(cfg, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
 
-def remove_nonproductive_rules(cfg):
     productives = get_productive_vars(cfg)
     worklist = []
     for key, rules in cfg.production_rules.items():
@@ -138,24 +272,26 @@ def remove_nonproductive_rules(cfg):
     for rem in worklist:
         cfg.remove_rule(rem)
 
+    return cfg
+
 
 def get_reachable_vars(cfg):
     reachables = {cfg.start_var}
-    changed = True
-    while changed:
-        changed = False
-        for key, rules in cfg.production_rules.items():
-            for rule in rules:
-                if rule.lhs in reachables:
-                    for var in rule.rhs:
-                        if isinstance(var, NonTerminal) and var not in reachables:
-                            reachables.add(var)
-                            changed = True
+    worklist = [cfg.start_var]
+    while worklist:
+        for rule in cfg.production_rules.get(worklist.pop(), ()):
+            for var in rule.rhs:
+                if isinstance(var, NonTerminal) and var not in reachables:
+                    reachables.add(var)
+                    worklist.append(var)
 
     return reachables
 
 
-def remove_nonreachable_rules(cfg):
+def remove_nonreachable_rules(cfg, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
+
     reachables = get_reachable_vars(cfg)
     worklist = []
     for key, rules in cfg.production_rules.items():
@@ -170,7 +306,151 @@ def remove_nonreachable_rules(cfg):
     for rem in worklist:
         cfg.remove_rule(rem)
 
-
-def remove_useless_vars(cfg):
-    remove_nonproductive_rules(cfg)
-    remove_nonreachable_rules(cfg)
+    return cfg
+
+
+def remove_useless_vars(cfg, in_place=True):
+    return reduce_grammar(cfg, in_place).cfg
+
+
+# the result of reduce_grammar: the reduced grammar, the non-terminals that
+# derive no word, the productive ones the start symbol does not reach, the
+# terminals no rule uses anymore and the number of removed rules
+ReductionReport = namedtuple("ReductionReport", ["cfg", "non_productive", "unreachable", "removed_terminals",
+                                                 "rules_removed"])
+
+
+# removes every rule that is not productive or not reachable in one pass. The
+# rules left are the same as after remove_nonproductive_rules followed by
+# remove_nonreachable_rules, non_terminals can differ: a removed non-terminal
+# whose only rule is a lambda rule (A -> & with A unreachable) is dropped
+# here, the two passes kept it. The rules are numbered once into a dependency
+# graph of flat lists (per non-terminal the rules it occurs in), so both sets
+# are computed in O(|G|) without hashing a single rule. The rule sets and
+# _refs are then rebuilt in bulk: unchanged sets are kept as they are, the
+# touched ones are replaced by set differences, which reuse the stored hashes.
+def reduce_grammar(cfg, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
+
+    keys = list(cfg.production_rules)
+    ids = {key: i for i, key in enumerate(keys)}
+    rules = []
+    rhs_ids = []
+    pending = []
+    # the rules of keys[i] are rules[first[i]:first[i + 1]]
+    first = [0]
+    occurrences = [[] for _ in keys]
+    for key_id, key in enumerate(keys):
+        for rule in cfg.production_rules[key]:
+            index = len(rules)
+            rules.append(rule)
+            distinct = {ids.get(var, -1) for var in rule.rhs if var.__class__ is NonTerminal}
+            if len(rule.rhs) == 1 and key_id in distinct:
+                # A -> A never makes A productive and is always removed
+                distinct = ()
+                pending.append(-1)
+            else:
+                pending.append(len(distinct))
+            rhs_ids.append(distinct)
+            for var_id in distinct:
+                if var_id >= 0:
+                    occurrences[var_id].append(index)
+        first.append(len(rules))
+
+    productive = [False] * len(keys)
+    worklist = []
+    for key_id in range(len(keys)):
+        if 0 in pending[first[key_id]:first[key_id + 1]]:
+            productive[key_id] = True
+            worklist.append(key_id)
+    while worklist:
+        for index in occurrences[worklist.pop()]:
+            pending[index] -= 1
+            if pending[index] == 0:
+                key_id = ids[rules[index].lhs]
+                if not productive[key_id]:
+                    productive[key_id] = True
+                    worklist.append(key_id)
+
+    # a rule is kept if its lhs is reachable and its pending counter is zero,
+    # i.e. every non-terminal on its rhs is productive
+    reachable = [False] * len(keys)
+    start_id = ids.get(cfg.start_var)
+    worklist = []
+    if start_id is not None:
+        reachable[start_id] = True
+        worklist.append(start_id)
+    while worklist:
+        key_id = worklist.pop()
+        for index in range(first[key_id], first[key_id + 1]):
+            if pending[index] == 0:
+                for var_id in rhs_ids[index]:
+                    if not reachable[var_id]:
+                        reachable[var_id] = True
+                        worklist.append(var_id)
+
+    removed = []
+    kept = dict()
+    for key_id, key in enumerate(keys):
+        if not reachable[key_id]:
+            removed.extend(rules[first[key_id]:first[key_id + 1]])
+            continue
+        count = 0
+        for index in range(first[key_id], first[key_id + 1]):
+            if pending[index] == 0:
+                count += 1
+            else:
+                removed.append(rules[index])
+        kept[key] = count
+
+    non_productive = cfg.non_terminals.difference(key for key_id, key in enumerate(keys) if productive[key_id])
+    unreachable = {key for key_id, key in enumerate(keys) if productive[key_id] and not reachable[key_id]}
+    terminals_before = set(cfg.terminals)
+    if removed:
+        _rebuild_without(cfg, set(removed), kept)
+    return ReductionReport(cfg, non_productive, unreachable, terminals_before - cfg.terminals, len(removed))
+
+
+# replaces the rule sets and _refs sets holding a rule of 'removed' by new sets
+# without them, in one pass over each mapping. 'kept' maps every lhs that keeps
+# rules to their number. The symbols left without rules and references are
+# dropped like CFG.remove_rule does.
+def _rebuild_without(cfg, removed, kept):
+    production_rules = dict()
+    for key, rules in cfg.production_rules.items():
+        count = kept.get(key)
+        if not count:
+            continue
+        if count == len(rules):
+            production_rules[key] = rules
+        else:
+            production_rules[key] = rules - removed
+            if cfg._owned_rules is not None:
+                cfg._owned_rules.add(key)
+
+    touched = set()
+    for rule in removed:
+        touched.add(rule.lhs)
+        if not isinstance(rule.rhs[0], Lambda):
+            touched.update(rule.rhs)
+    refs = dict()
+    for var, var_refs in cfg._refs.items():
+        if var not in touched:
+            refs[var] = var_refs
+            continue
+        rest = var_refs - removed
+        if rest:
+            refs[var] = rest
+            if cfg._owned_refs is not None:
+                cfg._owned_refs.add(var)
+
+    cfg.production_rules = production_rules
+    cfg._refs = refs
+    for var in touched:
+        if var in refs or var in production_rules:
+            continue
+        if isinstance(var, Terminal):
+            cfg.terminals.discard(var)
+        elif isinstance(var, NonTerminal):
+            cfg.non_terminals.discard(var)
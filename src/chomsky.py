@@ -1,77 +1,237 @@
-from collections import deque
+from collections import namedtuple
 import itertools
 
 import src.cfg
 import src.cfg_modify
-import itertools
+import src.profiling
 
 _chomsky_pref = "_CHOMSKY"
-_chomsky_it = 1
-
-
-def get_chomsky_term(t):
-    name = _chomsky_pref + str(t.value)
-    return src.cfg.NonTerminal(name)
-
-
-def add_terminal_rules(cfg):
-    for terminal in cfg.terminals:
-        cfg.add_rule(src.cfg.Rule(get_chomsky_term(terminal), [terminal]))
-
-
-def new_rule_name():
-    global _chomsky_it
-    name = _chomsky_pref + "_RULE" + str(_chomsky_it)
-    _chomsky_it += 1
-    return name
 
+# the result of transform_to_minimal_CNF: the converted grammar and its size
+# next to the size the plain conversion would have produced
+CNFReport = namedtuple("CNFReport", ["cfg", "rules", "non_terminals", "plain_rules", "plain_non_terminals",
+                                     "suffixes_shared", "non_terminals_merged"])
+
+
+class CNFConverter:
+    """
+    Class to encapsulate the state of one CNF conversion. All naming state
+    lives here, so separate conversions never interfere, and the rules are
+    split in sorted order, so the same grammar always gets the same names.
+
+    cfg = the grammar being converted, in place
+    prefix = the prefix of the names of introduced non-terminals
+    counter = the number of the next binarization non-terminal
+    taken = the names of non-terminals of the grammar, new names never reuse them
+    """
+
+    def __init__(self, cfg, prefix=_chomsky_pref):
+        self.cfg = cfg
+        self.prefix = prefix
+        self.counter = 1
+        self.taken = {var.value for var in cfg.non_terminals}
+        self._terms = dict()
+
+    def new_non_terminal(self):
+        name = self.prefix + "_RULE" + str(self.counter)
+        self.counter += 1
+        while name in self.taken:
+            name = self.prefix + "_RULE" + str(self.counter)
+            self.counter += 1
+        self.taken.add(name)
+        return src.cfg.NonTerminal(name)
+
+    # the non-terminal deriving only terminal 't', named prefix + 't' unless
+    # the grammar already uses that name
+    def term(self, t):
+        var = self._terms.get(t)
+        if var is None:
+            name = self.prefix + str(t.value)
+            while name in self.taken:
+                name += "_"
+            self.taken.add(name)
+            var = self._terms[t] = src.cfg.NonTerminal(name)
+        return var
+
+    def add_terminal_rules(self):
+        for terminal in sorted(self.cfg.terminals, key=str):
+            self.cfg.add_rule(src.cfg.Rule(self.term(terminal), [terminal]))
+
+    def split_rule(self, rule):
+        new_rules = []
+        old_lhs = rule.lhs
+        for i in range(len(rule.rhs) - 2):
+            new_non = self.new_non_terminal()
+            new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[i], new_non]))
+            old_lhs = new_non
+        else:
+            new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[-2], rule.rhs[-1]]))
+
+        return new_rules
+
+    # like split_rule, but the binarization non-terminal of every rhs suffix is
+    # looked up in 'suffixes' first, so rules ending in the same tail share the
+    # chain deriving it. Returns the new rules and whether a suffix was reused.
+    def split_rule_shared(self, rule, suffixes):
+        new_rules = []
+        old_lhs = rule.lhs
+        for i in range(len(rule.rhs) - 2):
+            suffix = rule.rhs[i + 1:]
+            new_non = suffixes.get(suffix)
+            if new_non is not None:
+                new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[i], new_non]))
+                return new_rules, True
+            new_non = self.new_non_terminal()
+            suffixes[suffix] = new_non
+            new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[i], new_non]))
+            old_lhs = new_non
+        else:
+            new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[-2], rule.rhs[-1]]))
+
+        return new_rules, False
+
+    # removes lambda and unit rules and lifts the terminals out of every rhs
+    # longer than one
+    def to_binary_form(self):
+        cfg = self.cfg
+        with src.profiling.phase("remove_lambdas", cfg):
+            src.cfg_modify.remove_lambdas(cfg)
+        with src.profiling.phase("remove_unit_rules", cfg):
+            src.cfg_modify.remove_unit_rules(cfg)
+
+        with src.profiling.phase("lift_terminals", cfg):
+            self.add_terminal_rules()
+            remlist = []
+            addlist = []
+            for key, rules in cfg.production_rules.items():
+                for rule in rules:
+                    new_rhs = []
+                    if len(rule.rhs) > 1:
+                        for var in rule.rhs:
+                            if isinstance(var, src.cfg.Terminal):
+                                new_rhs.append(self.term(var))
+                            else:
+                                new_rhs.append(var)
+                        remlist.append(rule)
+                        addlist.append(src.cfg.Rule(rule.lhs, new_rhs))
+
+            for rem, add in itertools.zip_longest(remlist, addlist):
+                cfg.remove_rule(rem)
+                cfg.add_rule(add)
+
+    # replaces every rule longer than two by the rules split(rule) returns, the
+    # rules are visited in sorted order to keep the names deterministic
+    def split_rules(self, split):
+        remlist = sorted((rule for rules in self.cfg.production_rules.values() for rule in rules
+                          if len(rule.rhs) > 2), key=str)
+        addlist = []
+        for rule in remlist:
+            addlist += split(rule)
+
+        for rem in remlist:
+            self.cfg.remove_rule(rem)
+
+        for add in addlist:
+            self.cfg.add_rule(add)
+
+    def convert(self):
+        with src.profiling.phase("transform_to_CNF", self.cfg):
+            self.to_binary_form()
+            with src.profiling.phase("split_rules", self.cfg):
+                self.split_rules(self.split_rule)
+
+    def convert_minimal(self):
+        cfg = self.cfg
+        with src.profiling.phase("transform_to_minimal_CNF", cfg):
+            self.to_binary_form()
+            plain_rules = 0
+            plain_non_terminals = len(cfg.non_terminals)
+            for rules in cfg.production_rules.values():
+                for rule in rules:
+                    plain_rules += max(1, len(rule.rhs) - 1)
+                    plain_non_terminals += max(0, len(rule.rhs) - 2)
+
+            suffixes = dict()
+            shared = 0
+
+            def split(rule):
+                nonlocal shared
+                new_rules, reused = self.split_rule_shared(rule, suffixes)
+                shared += reused
+                return new_rules
+
+            with src.profiling.phase("split_rules", cfg):
+                self.split_rules(split)
+            with src.profiling.phase("merge_non_terminals", cfg):
+                merged = merge_equivalent_non_terminals(cfg, self.prefix)
+
+        return CNFReport(cfg, sum(len(rules) for rules in cfg.production_rules.values()), len(cfg.non_terminals),
+                         plain_rules, plain_non_terminals, shared, len(merged))
+
+
+# converts 'cfg' to Chomsky normal form and returns it. With in_place=False
+# 'cfg' is left untouched and a converted copy-on-write copy is returned.
+def transform_to_CNF(cfg, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
+    CNFConverter(cfg).convert()
+    return cfg
+
+
+# CNF conversion that keeps the grammar small: identical rhs suffixes share
+# one binarization non-terminal and non-terminals with identical rule sets are
+# merged afterwards. Returns a CNFReport.
+def transform_to_minimal_CNF(cfg, in_place=True):
+    if not in_place:
+        cfg = cfg.copy()
+    return CNFConverter(cfg).convert_minimal()
+
+
+# merges non-terminals with identical sets of rhs into one, until no two
+# are left. Merging can make further rule sets identical, so this repeats.
+# The start symbol is never merged, non-terminals named with 'prefix' are
+# merged into the others. Returns a mapping of every merged non-terminal to
+# the one that replaced it.
+def merge_equivalent_non_terminals(cfg, prefix=_chomsky_pref):
+    def merge_order(var):
+        return var.value.startswith(prefix), str(var)
+
+    merged = dict()
+    while True:
+        groups = dict()
+        for key, rules in cfg.production_rules.items():
+            if key is not cfg.start_var:
+                groups.setdefault(frozenset(rule.rhs for rule in rules), []).append(key)
+
+        renames = dict()
+        for group in groups.values():
+            if len(group) > 1:
+                group.sort(key=merge_order)
+                for var in group[1:]:
+                    renames[var] = group[0]
+        if not renames:
+            break
+
+        for var, target in merged.items():
+            merged[var] = renames.get(target, target)
+        merged.update(renames)
+        _rename(cfg, renames)
+
+    return merged
+
+
+def _rename(cfg, renames):
+    remlist = set()
+    for var in renames:
+        remlist.update(cfg.production_rules.get(var, ()))
+        remlist.update(cfg._refs.get(var, ()))
 
-def split_rule(rule):
-    new_rules = []
-    old_lhs = rule.lhs
-    for i in range(len(rule.rhs) - 2):
-        new_non = src.cfg.NonTerminal(new_rule_name())
-        new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[i], new_non]))
-        old_lhs = new_non
-    else:
-        new_rules.append(src.cfg.Rule(old_lhs, [rule.rhs[-2], rule.rhs[-1]]))
-
-    return new_rules
-
-
-def transform_to_CNF(cfg):
-    src.cfg_modify.remove_lambdas(cfg)
-    src.cfg_modify.remove_unit_rules(cfg)
-    add_terminal_rules(cfg)
-    remlist = []
     addlist = []
-    for key, rules in cfg.production_rules.items():
-        for rule in rules:
-            new_rhs = []
-            if len(rule.rhs) > 1:
-                for var in rule.rhs:
-                    if isinstance(var, src.cfg.Terminal):
-                        new_rhs.append(get_chomsky_term(var))
-                    else:
-                        new_rhs.append(var)
-                remlist.append(rule)
-                addlist.append(src.cfg.Rule(rule.lhs, new_rhs))
-
-    for rem, add in itertools.zip_longest(remlist, addlist):
-        cfg.remove_rule(rem)
-        cfg.add_rule(add)
-
-    remlist.clear()
-    addlist.clear()
-
-    for key, rules in cfg.production_rules.items():
-        for rule in rules:
-            if len(rule.rhs) > 2:
-                addlist += split_rule(rule)
-                remlist.append(rule)
+    for rule in remlist:
+        if rule.lhs not in renames:
+            addlist.append(src.cfg.Rule(rule.lhs, [renames.get(var, var) for var in rule.rhs]))
 
     for rem in remlist:
         cfg.remove_rule(rem)
-
-    for add in addlist:
-        cfg.add_rule(add)
+    cfg.add_rules(addlist)
+    cfg.non_terminals.difference_update(renames)
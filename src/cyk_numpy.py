@@ -0,0 +1,63 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class NumpyTables:
+    """
+    Class to encapsulate the NumPy form of a CompiledCNF. The binary rules are
+    kept as a sparse equivalent of the (|N|, |N|, |N|) rule tensor: one column
+    per (B, C) pair that occurs on some rhs.
+
+    pair_left, pair_right = index arrays holding B and C of every pair
+    pair_lhs = a (pairs, |N|) matrix, entry (p, A) is 1 if A -> BC for pair p
+    terminal_rows = a mapping of Terminal to the boolean row of non-terminals producing it
+    """
+
+    def __init__(self, compiled):
+        if np is None:
+            raise ImportError("the numpy CYK backend requires numpy to be installed")
+
+        size = len(compiled.non_terminals)
+        pairs = list(compiled.pair_masks.items())
+        self.size = size
+        self.pair_left = np.array([b for (b, c), mask in pairs], dtype=np.intp)
+        self.pair_right = np.array([c for (b, c), mask in pairs], dtype=np.intp)
+        self.pair_lhs = np.zeros((len(pairs), size), dtype=np.float32)
+        for p, (pair, mask) in enumerate(pairs):
+            self.pair_lhs[p] = _mask_row(mask, size)
+        self.terminal_rows = {term: _mask_row(mask, size) for term, mask in compiled.terminal_masks.items()}
+        self.empty_row = np.zeros(size, dtype=bool)
+
+
+def _mask_row(mask, size):
+    return np.array([mask >> i & 1 for i in range(size)], dtype=bool)
+
+
+# fills a (n, n, |N|) boolean chart, chart[l - 1, i] holds the non-terminals
+# deriving word[i:i + l]. Every span length is filled at once for all start
+# positions: for every split the rule pairs present in the left and right
+# cells are collected, then one matrix product maps them to their lhs.
+def numpy_chart(tables, word):
+    length = len(word)
+    chart = np.zeros((length, length, tables.size), dtype=bool)
+    for i, token in enumerate(word):
+        chart[0, i] = tables.terminal_rows.get(token, tables.empty_row)
+
+    for span in range(2, length + 1):
+        starts = length - span + 1
+        present = np.zeros((starts, len(tables.pair_left)), dtype=bool)
+        for split in range(1, span):
+            left = chart[split - 1, :starts]
+            right = chart[span - split - 1, split:split + starts]
+            present |= left[:, tables.pair_left] & right[:, tables.pair_right]
+        chart[span - 1, :starts] = present.astype(np.float32) @ tables.pair_lhs > 0
+
+    return chart
+
+
+def numpy_parse(compiled, tables, word):
+    if len(word) == 0 or compiled.start_id is None:
+        return False
+    return bool(numpy_chart(tables, word)[len(word) - 1, 0, compiled.start_id])
@@ -0,0 +1,72 @@
+from src.cfg import Lambda, NonTerminal
+from src.cfg_modify import get_erasable_vars
+
+
+# numbers the rules of the CFG, lambda rules get an empty rhs
+def _index_rules(cfg):
+    rules = []
+    by_lhs = dict()
+    for key, key_rules in cfg.production_rules.items():
+        indices = []
+        for rule in key_rules:
+            rhs = () if isinstance(rule.rhs[0], Lambda) else tuple(rule.rhs)
+            indices.append(len(rules))
+            rules.append((rule, rhs))
+        by_lhs[key] = indices
+    return rules, by_lhs
+
+
+# Earley recognizer working directly on the CFG, no CNF conversion needed.
+# Items are (rule index, dot, origin). Nullable non-terminals are skipped
+# over when predicted (Aycock & Horspool), so completions never have to look
+# back into the item set that is currently being built.
+def earley_parser(cfg, word):
+    if cfg.start_var is None:
+        return False
+
+    nullable = get_erasable_vars(cfg)
+    rules, by_lhs = _index_rules(cfg)
+    length = len(word)
+    item_sets = [[] for _ in range(length + 1)]
+    seen = [set() for _ in range(length + 1)]
+    # per item set: symbol after the dot -> items waiting on that symbol
+    waiting = [dict() for _ in range(length + 1)]
+
+    def add(i, item):
+        if item not in seen[i]:
+            seen[i].add(item)
+            item_sets[i].append(item)
+
+    for index in by_lhs.get(cfg.start_var, ()):
+        add(0, (index, 0, 0))
+
+    for i in range(length + 1):
+        items = item_sets[i]
+        k = 0
+        while k < len(items):
+            item = items[k]
+            k += 1
+            index, dot, origin = item
+            rule, rhs = rules[index]
+            if dot < len(rhs):
+                var = rhs[dot]
+                if isinstance(var, NonTerminal):
+                    waiting[i].setdefault(var, []).append(item)
+                    for predicted in by_lhs.get(var, ()):
+                        add(i, (predicted, 0, i))
+                    if var in nullable:
+                        add(i, (index, dot + 1, origin))
+                elif i < length and var == word[i]:
+                    add(i + 1, (index, dot + 1, origin))
+            elif origin < i:
+                for w_index, w_dot, w_origin in waiting[origin].get(rule.lhs, ()):
+                    add(i, (w_index, w_dot + 1, w_origin))
+
+        if i < length and not item_sets[i + 1]:
+            return False
+
+    for index, dot, origin in item_sets[length]:
+        rule, rhs = rules[index]
+        if origin == 0 and dot == len(rhs) and rule.lhs == cfg.start_var:
+            return True
+    return False
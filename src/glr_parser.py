@@ -0,0 +1,226 @@
+import pickle
+
+from src.cfg import NonTerminal, Terminal
+from src.cfg_modify import get_erasable_vars, remove_lambdas
+
+# bump whenever the layout of GLRTables changes, pickled tables of an older
+# version are rejected
+TABLES_VERSION = 1
+
+
+class GLRTables:
+    """
+    Class to encapsulate the SLR(1) automaton of a CFG for the GLR recognizer.
+    The automaton is built from a lambda free copy of the grammar (every rhs
+    derives at least one terminal), so the graph-structured stack of a parse
+    never has edges within one level. Conflicts are kept, the recognizer
+    follows every action.
+
+    start_var = the start symbol of the grammar
+    accepts_empty = whether the empty word is in the language
+    shifts = per state, a mapping of Terminal to the state shifted to
+    gotos = per state, a mapping of NonTerminal to the state after reducing it
+    reductions = per state, a mapping of lookahead (a Terminal, None at the end
+                 of the word) to a tuple of (lhs, rhs length) to reduce
+    accept_state = the state reached from state 0 by the start symbol, None
+                   if the start symbol derives no non-empty word
+    """
+
+    def __init__(self, cfg):
+        self.start_var = cfg.start_var
+        self.accepts_empty = cfg.start_var in get_erasable_vars(cfg)
+        cfg = remove_lambdas(cfg, in_place=False)
+
+        rules = []
+        by_lhs = dict()
+        for key in sorted(cfg.production_rules, key=str):
+            for rule in sorted(cfg.production_rules[key], key=str):
+                by_lhs.setdefault(key, []).append(len(rules))
+                rules.append((key, rule.rhs))
+        # the augmented rule S' -> S, S' is None
+        rules.append((None, (cfg.start_var,) if cfg.start_var is not None else ()))
+
+        follow = _follow_sets(cfg, rules)
+
+        def closure(kernel):
+            items = list(kernel)
+            seen = set(kernel)
+            for index, dot in items:
+                rhs = rules[index][1]
+                if dot < len(rhs) and isinstance(rhs[dot], NonTerminal):
+                    for predicted in by_lhs.get(rhs[dot], ()):
+                        if (predicted, 0) not in seen:
+                            seen.add((predicted, 0))
+                            items.append((predicted, 0))
+            return items
+
+        states = {frozenset([(len(rules) - 1, 0)]): 0}
+        kernels = [[(len(rules) - 1, 0)]]
+        self.shifts = []
+        self.gotos = []
+        self.reductions = []
+        self.accept_state = None
+        for kernel in kernels:
+            shifts = dict()
+            gotos = dict()
+            reductions = dict()
+            moves = dict()
+            for index, dot in closure(kernel):
+                lhs, rhs = rules[index]
+                if dot < len(rhs):
+                    moves.setdefault(rhs[dot], []).append((index, dot + 1))
+                elif lhs is not None:
+                    for lookahead in follow.get(lhs, ()):
+                        reductions.setdefault(lookahead, []).append((lhs, len(rhs)))
+
+            for var, moved in moves.items():
+                key = frozenset(moved)
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = len(kernels)
+                    kernels.append(moved)
+                if isinstance(var, Terminal):
+                    shifts[var] = state
+                else:
+                    gotos[var] = state
+                    if kernel is kernels[0] and var is cfg.start_var:
+                        self.accept_state = state
+
+            self.shifts.append(shifts)
+            self.gotos.append(gotos)
+            self.reductions.append({lookahead: tuple(reduce) for lookahead, reduce in reductions.items()})
+
+    def conflicts(self):
+        ret = 0
+        for shifts, reductions in zip(self.shifts, self.reductions):
+            for lookahead, reduce in reductions.items():
+                ret += len(reduce) - 1 + (lookahead in shifts)
+        return ret
+
+    def __len__(self):
+        return len(self.shifts)
+
+    def dumps(self):
+        return pickle.dumps((TABLES_VERSION, self), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        version, tables = pickle.loads(data)
+        if version != TABLES_VERSION:
+            raise ValueError("GLR tables of version " + str(version) + ", expected " + str(TABLES_VERSION))
+        return tables
+
+
+# FOLLOW sets of a lambda free grammar, None stands for the end of the word
+def _follow_sets(cfg, rules):
+    first = dict()
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rhs in rules:
+            if lhs is None:
+                continue
+            head = rhs[0]
+            new = {head} if isinstance(head, Terminal) else first.get(head, set())
+            current = first.setdefault(lhs, set())
+            if not new <= current:
+                current |= new
+                changed = True
+
+    follow = {cfg.start_var: {None}}
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rhs in rules:
+            if lhs is None:
+                continue
+            for i, var in enumerate(rhs):
+                if not isinstance(var, NonTerminal):
+                    continue
+                if i + 1 < len(rhs):
+                    after = rhs[i + 1]
+                    new = {after} if isinstance(after, Terminal) else first.get(after, set())
+                else:
+                    new = follow.get(lhs, set())
+                current = follow.setdefault(var, set())
+                if not new <= current:
+                    current |= new
+                    changed = True
+
+    return follow
+
+
+class _Node:
+    __slots__ = ("state", "edges")
+
+    def __init__(self, state):
+        self.state = state
+        self.edges = set()
+
+
+# the nodes at the end of all paths of 'length' edges from 'node'
+def _path_ends(node, length):
+    ends = {node}
+    for _ in range(length):
+        ends = {pred for end in ends for pred in end.edges}
+    return ends
+
+
+# GLR recognizer (Tomita, with the reduction worklist of the RNGLR algorithm
+# by Scott & Johnstone restricted to lambda free grammars). The stacks of all
+# parses share one graph-structured stack: a level per token position and at
+# most one node per state and level. A pending reduction (node, lhs, length)
+# reduces lhs over every path of 'length' edges from node. When a reduction
+# adds an edge to a node that already exists, the reductions of that node are
+# queued again for paths through the new edge only.
+# Deterministic stretches of the word keep one node per level and run in
+# linear time.
+#
+# 'grammar' is a CFG or the GLRTables built from one.
+def glr_parser(grammar, word):
+    tables = grammar if isinstance(grammar, GLRTables) else GLRTables(grammar)
+    if len(word) == 0:
+        return tables.accepts_empty
+    if tables.accept_state is None:
+        return False
+
+    shifts = tables.shifts
+    gotos = tables.gotos
+    reductions = tables.reductions
+    level = {0: _Node(0)}
+    for i in range(len(word) + 1):
+        lookahead = word[i] if i < len(word) else None
+        pending = []
+        for node in level.values():
+            for lhs, length in reductions[node.state].get(lookahead, ()):
+                pending.append((node, lhs, length))
+
+        while pending:
+            node, lhs, length = pending.pop()
+            for end in _path_ends(node, length):
+                state = gotos[end.state][lhs]
+                target = level.get(state)
+                if target is None:
+                    target = level[state] = _Node(state)
+                    target.edges.add(end)
+                    for reduce_lhs, reduce_length in reductions[state].get(lookahead, ()):
+                        pending.append((target, reduce_lhs, reduce_length))
+                elif end not in target.edges:
+                    target.edges.add(end)
+                    for reduce_lhs, reduce_length in reductions[state].get(lookahead, ()):
+                        pending.append((end, reduce_lhs, reduce_length - 1))
+
+        if lookahead is None:
+            return tables.accept_state in level
+
+        next_level = dict()
+        for node in level.values():
+            state = shifts[node.state].get(lookahead)
+            if state is not None:
+                target = next_level.get(state)
+                if target is None:
+                    target = next_level[state] = _Node(state)
+                target.edges.add(node)
+        if not next_level:
+            return False
+        level = next_level
@@ -0,0 +1,216 @@
+from array import array
+import functools
+import gzip
+import hashlib
+import os
+import struct
+import sys
+
+from src.cfg import CFG, Lambda, NonTerminal, Rule, Terminal
+from src.chomsky import transform_to_CNF
+from src.glr_parser import GLRTables
+from src.Error import InputError
+from src.parser import load_grammar
+
+# bump whenever the file layout or the result of a cached transform changes,
+# this invalidates every cache entry.
+# 2: transform_to_CNF names its non-terminals through CNFConverter, splitting
+#    the rules in sorted order
+CACHE_VERSION = 2
+
+_magic = b"CFGB"
+# magic, version, symbol count, rule count, rhs length total, start id, names size
+_header = struct.Struct("<4sHIIIiI")
+_kinds = {Terminal: 0, NonTerminal: 1, Lambda: 2}
+# set in the kind byte when the symbol is in cfg.terminals or cfg.non_terminals
+_in_symbol_set = 4
+
+
+def _little_endian(arr):
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+# the compact binary layout of a CFG: a header, the symbol names, one kind byte
+# per symbol and three uint32 arrays holding the lhs id of every rule, the rhs
+# length of every rule and the concatenated rhs ids
+def dumps_cfg(cfg):
+    ids = dict()
+    symbols = []
+
+    def symbol_id(var):
+        ret = ids.get(var)
+        if ret is None:
+            ret = len(symbols)
+            ids[var] = ret
+            symbols.append(var)
+        return ret
+
+    lhs_ids = array("I")
+    rhs_lengths = array("I")
+    rhs_ids = array("I")
+    for key, rules in cfg.production_rules.items():
+        for rule in rules:
+            lhs_ids.append(symbol_id(key))
+            rhs_lengths.append(len(rule.rhs))
+            rhs_ids.extend(symbol_id(var) for var in rule.rhs)
+
+    for var in list(cfg.terminals) + list(cfg.non_terminals):
+        symbol_id(var)
+    start_id = -1 if cfg.start_var is None else symbol_id(cfg.start_var)
+
+    names = "\n".join("" if isinstance(var, Lambda) else var.value for var in symbols).encode()
+    kinds = bytearray()
+    for var in symbols:
+        kind = _kinds[type(var)]
+        if var in cfg.terminals or var in cfg.non_terminals:
+            kind |= _in_symbol_set
+        kinds.append(kind)
+
+    return b"".join([_header.pack(_magic, CACHE_VERSION, len(symbols), len(lhs_ids), len(rhs_ids),
+                                  start_id, len(names)),
+                     names, bytes(kinds),
+                     _little_endian(lhs_ids).tobytes(),
+                     _little_endian(rhs_lengths).tobytes(),
+                     _little_endian(rhs_ids).tobytes()])
+
+
+def loads_cfg(data):
+    magic, version, symbol_count, rule_count, rhs_count, start_id, names_size = _header.unpack_from(data)
+    if magic != _magic or version != CACHE_VERSION:
+        raise InputError(str(magic), "Not a grammar file of version " + str(CACHE_VERSION))
+
+    view = memoryview(data)
+    offset = _header.size
+    names = bytes(view[offset:offset + names_size]).decode().split("\n")
+    offset += names_size
+    kinds = view[offset:offset + symbol_count]
+    offset += symbol_count
+
+    def read_array(count):
+        nonlocal offset
+        ret = array("I")
+        ret.frombytes(view[offset:offset + count * ret.itemsize])
+        offset += count * ret.itemsize
+        return _little_endian(ret)
+
+    lhs_ids = read_array(rule_count)
+    rhs_lengths = read_array(rule_count)
+    rhs_ids = read_array(rhs_count)
+
+    symbols = []
+    for name, kind in zip(names, kinds):
+        if kind & 3 == 0:
+            symbols.append(Terminal(name))
+        elif kind & 3 == 1:
+            symbols.append(NonTerminal(name))
+        else:
+            symbols.append(Lambda())
+
+    rules = []
+    position = 0
+    for lhs, length in zip(lhs_ids, rhs_lengths):
+        rules.append(Rule(symbols[lhs], [symbols[i] for i in rhs_ids[position:position + length]]))
+        position += length
+
+    cfg = CFG()
+    cfg.add_rules(rules)
+    cfg.terminals = {var for var, kind in zip(symbols, kinds) if kind == _kinds[Terminal] | _in_symbol_set}
+    cfg.non_terminals = {var for var, kind in zip(symbols, kinds) if kind == _kinds[NonTerminal] | _in_symbol_set}
+    cfg.start_var = None if start_id < 0 else symbols[start_id]
+    return cfg
+
+
+def save_cfg(cfg, path):
+    with open(path, "wb") as f:
+        f.write(dumps_cfg(cfg))
+
+
+def load_cfg(path):
+    with open(path, "rb") as f:
+        return loads_cfg(f.read())
+
+
+def _default_cache_dir():
+    return os.path.join(os.path.expanduser("~"), ".cache", "cfg-work")
+
+
+# the cache key covers the grammar source, the transforms that are applied to
+# it in order and the cache version
+def cache_key(source, pipeline):
+    key = hashlib.sha256(source)
+    key.update(str(CACHE_VERSION).encode())
+    for step in pipeline:
+        key.update(("\n" + _step_name(step)).encode())
+    return key.hexdigest()
+
+
+# the name a pipeline step is cached under: its module and qualified name, for
+# a functools.partial also the repr of its bound arguments. Lambdas and nested
+# functions are rejected, their names do not tell two of them apart.
+def _step_name(step):
+    if isinstance(step, functools.partial):
+        keywords = ", ".join(name + "=" + repr(value) for name, value in sorted(step.keywords.items()))
+        return _step_name(step.func) + "(" + repr(step.args) + ", " + keywords + ")"
+
+    qualname = getattr(step, "__qualname__", None)
+    if qualname is None or "<lambda>" in qualname or "<locals>" in qualname:
+        raise ValueError("Pipeline step " + repr(step) + " has no unique name, use a module level "
+                         "function or a functools.partial of one")
+    return step.__module__ + "." + qualname
+
+
+# loads the grammar file at 'path' and applies every transform of 'pipeline' to
+# it in order. The result is stored in 'cache_dir' and loaded from there as long
+# as neither the file nor the pipeline change.
+def cached_grammar(path, pipeline=(), cache_dir=None):
+    if cache_dir is None:
+        cache_dir = _default_cache_dir()
+
+    with open(path, "rb") as f:
+        source = f.read()
+    cache_path = os.path.join(cache_dir, cache_key(source, pipeline) + ".cfgb")
+    if os.path.exists(cache_path):
+        return load_cfg(cache_path)
+
+    if os.fspath(path).endswith(".gz"):
+        source = gzip.decompress(source)
+    cfg = load_grammar(source.decode().splitlines())
+    for step in pipeline:
+        step(cfg)
+
+    # written to a temporary file first so concurrent readers never see a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    save_cfg(cfg, temp_path)
+    os.replace(temp_path, cache_path)
+    return cfg
+
+
+def cached_cnf(path, cache_dir=None):
+    return cached_grammar(path, (transform_to_CNF,), cache_dir)
+
+
+# the GLRTables of the grammar file at 'path', cached like cached_grammar
+def cached_glr_tables(path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = _default_cache_dir()
+
+    with open(path, "rb") as f:
+        source = f.read()
+    cache_path = os.path.join(cache_dir, cache_key(source, (GLRTables,)) + ".glr")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return GLRTables.loads(f.read())
+
+    if os.fspath(path).endswith(".gz"):
+        source = gzip.decompress(source)
+    tables = GLRTables(load_grammar(source.decode().splitlines()))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(tables.dumps())
+    os.replace(temp_path, cache_path)
+    return tables
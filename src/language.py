@@ -0,0 +1,264 @@
+import random
+
+from src.bitset import iter_bits
+from src.chomsky import transform_to_CNF
+from src.cfg_modify import get_erasable_vars
+from src.CYK_parser import CompiledCNF
+
+
+class Language:
+    """
+    Class to encapsulate the language of a CFG for counting, enumerating and
+    sampling its words. Works on the CNF of the grammar, with two tables per
+    word length t that are extended on demand: derives[t], the bitmask of
+    non-terminals deriving some word of length t, and counts[t], the number of
+    derivations of a word of length t per non-terminal. Memory depends on the
+    longest length asked for and the grammar, never on the number of words.
+
+    compiled = the CompiledCNF of the grammar
+    terminals = the terminals of the grammar, in the order words are enumerated
+    accepts_empty = whether the empty word is in the language
+    """
+
+    def __init__(self, cfg):
+        self.accepts_empty = cfg.start_var is not None and cfg.start_var in get_erasable_vars(cfg)
+        self.compiled = CompiledCNF(transform_to_CNF(cfg, in_place=False))
+        self.terminals = tuple(sorted(self.compiled.terminal_masks, key=str))
+        self._derives = [0, 0]
+        for mask in self.compiled.terminal_masks.values():
+            self._derives[1] |= mask
+        self._counts = [None, [0] * len(self.compiled.non_terminals)]
+        for mask in self.compiled.terminal_masks.values():
+            for a in iter_bits(mask):
+                self._counts[1][a] += 1
+
+    def _derives_up_to(self, length):
+        derives = self._derives
+        for t in range(len(derives), length + 1):
+            mask = 0
+            for k in range(1, t):
+                mask |= self.compiled.combine(derives[k], derives[t - k])
+            derives.append(mask)
+        return derives
+
+    def _counts_up_to(self, length):
+        counts = self._counts
+        for t in range(len(counts), length + 1):
+            row = []
+            for pairs in self.compiled.pairs_by_lhs:
+                total = 0
+                for b, c in pairs:
+                    for k in range(1, t):
+                        total += counts[k][b] * counts[t - k][c]
+                row.append(total)
+            counts.append(row)
+        return counts
+
+    def _has_length(self, length):
+        if length == 0:
+            return self.accepts_empty
+        start = self.compiled.start_id
+        return start is not None and self._derives_up_to(length)[length] >> start & 1 == 1
+
+    # the number of derivations of words of 'length' in the CNF grammar. This is
+    # the number of words if the grammar is unambiguous, and an upper bound else.
+    def count_derivations(self, length):
+        if length == 0:
+            return int(self.accepts_empty)
+        if self.compiled.start_id is None:
+            return 0
+        return self._counts_up_to(length)[length][self.compiled.start_id]
+
+    # the exact number of words of 'length', found by enumerating them, so the
+    # time grows with that number. count_derivations is faster for unambiguous
+    # grammars.
+    def count_words(self, length):
+        return sum(1 for _ in self.words_of_length(length))
+
+    # whether some word of length 'length' - len(prefix) starting with 'prefix'
+    # is derived from the start symbol. 'chart' is the CYK chart of 'prefix'.
+    # tails[i][t] is the bitmask of non-terminals deriving prefix[i:] followed
+    # by any t tokens, built from the right: a rule A -> BC either has B end
+    # inside the prefix, or B takes the prefix and the first t1 tokens of the tail.
+    def _viable(self, chart, length):
+        size = len(chart) - 1
+        rest = length - size
+        start = self.compiled.start_id
+        if rest == 0:
+            return chart[size][0] >> start & 1 == 1
+
+        combine = self.compiled.combine
+        derives = self._derives_up_to(rest)
+        tails = [None] * size + [derives[:rest + 1]]
+        for i in range(size - 1, -1, -1):
+            row = [chart[size][i]]
+            for t in range(1, rest + 1):
+                mask = 0
+                for j in range(i + 1, size + 1):
+                    left = chart[j][i]
+                    if left:
+                        mask |= combine(left, tails[j][t])
+                for t1 in range(1, t):
+                    if row[t1]:
+                        mask |= combine(row[t1], derives[t - t1])
+                row.append(mask)
+            tails[i] = row
+        return tails[0][rest] >> start & 1 == 1
+
+    # lazily yields every word of 'length' in lexicographic order of the
+    # terminal names. The prefix is extended one token at a time and only
+    # viable prefixes are followed, so every yielded word is distinct and a
+    # dead end is found after at most len(terminals) checks.
+    def words_of_length(self, length):
+        if length == 0:
+            if self.accepts_empty:
+                yield []
+            return
+        if not self._has_length(length):
+            return
+
+        compiled = self.compiled
+        prefix = []
+        chart = [None]
+        choices = [0]
+        while choices:
+            if choices[-1] == len(self.terminals):
+                choices.pop()
+                if prefix:
+                    prefix.pop()
+                    chart.pop()
+                continue
+
+            token = self.terminals[choices[-1]]
+            choices[-1] += 1
+            prefix.append(token)
+            chart.append([0] * len(prefix))
+            chart[-1][-1] = compiled.terminal_masks[token]
+            compiled.fill_column(chart, len(prefix))
+            if not self._viable(chart, length):
+                prefix.pop()
+                chart.pop()
+            elif len(prefix) == length:
+                yield list(prefix)
+                prefix.pop()
+                chart.pop()
+            else:
+                choices.append(0)
+
+    def _useful(self):
+        productive = self.compiled.prefix_tables()[0]
+        start = self.compiled.start_id
+        if start is None or not productive >> start & 1:
+            return 0
+        useful = 1 << start
+        worklist = [start]
+        while worklist:
+            for b, c in self.compiled.pairs_by_lhs[worklist.pop()]:
+                if productive >> b & 1 and productive >> c & 1:
+                    for var in (b, c):
+                        if not useful >> var & 1:
+                            useful |= 1 << var
+                            worklist.append(var)
+        return useful
+
+    # the length of the longest word, None if the language is infinite. In CNF
+    # every cycle between useful non-terminals can be pumped.
+    def max_word_length(self):
+        useful = self._useful()
+        if not useful:
+            return 0
+        longest = dict()
+        visiting = set()
+        # iterative post order over the useful part of the rule graph
+        for root in iter_bits(useful):
+            if root in longest:
+                continue
+            stack = [(root, False)]
+            while stack:
+                var, done = stack.pop()
+                if done:
+                    visiting.discard(var)
+                    best = 1 if any(mask >> var & 1 for mask in self.compiled.terminal_masks.values()) else 0
+                    for b, c in self.compiled.pairs_by_lhs[var]:
+                        if useful >> b & 1 and useful >> c & 1:
+                            best = max(best, longest[b] + longest[c])
+                    longest[var] = best
+                    continue
+                if var in longest:
+                    continue
+                if var in visiting:
+                    return None
+                visiting.add(var)
+                stack.append((var, True))
+                for b, c in self.compiled.pairs_by_lhs[var]:
+                    if useful >> b & 1 and useful >> c & 1:
+                        for child in (b, c):
+                            if child in visiting:
+                                return None
+                            if child not in longest:
+                                stack.append((child, False))
+
+        return longest[self.compiled.start_id]
+
+    def is_finite(self):
+        return self.max_word_length() is not None
+
+    # lazily yields the words of the language by increasing length, each length
+    # in lexicographic order. Without 'max_length' a finite language stops after
+    # its longest word and an infinite one never stops.
+    def enumerate_words(self, max_length=None):
+        if max_length is None:
+            max_length = self.max_word_length()
+        length = 0
+        while max_length is None or length <= max_length:
+            yield from self.words_of_length(length)
+            length += 1
+
+    # a random derivation of a word of 'length' from the start symbol, every
+    # derivation equally likely
+    def _sample_derivation(self, length, rng):
+        counts = self._counts_up_to(length)
+        word = []
+        pending = [(self.compiled.start_id, length)]
+        while pending:
+            var, t = pending.pop()
+            if t == 1:
+                word.append(rng.choice([token for token in self.terminals
+                                        if self.compiled.terminal_masks[token] >> var & 1]))
+                continue
+            pick = rng.randrange(counts[t][var])
+            for b, c in self.compiled.pairs_by_lhs[var]:
+                for k in range(1, t):
+                    ways = counts[k][b] * counts[t - k][c]
+                    if pick < ways:
+                        pending.append((c, t - k))
+                        pending.append((b, k))
+                        break
+                    pick -= ways
+                else:
+                    continue
+                break
+        return word
+
+    # a word of 'length' drawn uniformly from the language, None if there is
+    # none. Derivations are sampled uniformly and a word with d derivations is
+    # kept with probability 1/d, which makes every word equally likely. That
+    # needs (derivations / words) tries on average, after 'max_tries' a
+    # ValueError is raised. uniform=False returns the first sampled derivation,
+    # which is uniform over words only for unambiguous grammars.
+    def sample_word(self, length, rng=random, uniform=True, max_tries=1000):
+        if length == 0:
+            return [] if self.accepts_empty else None
+        if not self._has_length(length):
+            return None
+
+        for _ in range(max_tries):
+            word = self._sample_derivation(length, rng)
+            if not uniform or rng.randrange(self.compiled.parse_forest(word).count()) == 0:
+                return word
+        raise ValueError("no word accepted after " + str(max_tries) + " tries, the grammar is too ambiguous "
+                         "for uniform sampling of length " + str(length) + ", see uniform=False")
+
+
+def enumerate_words(cfg, max_length=None):
+    return Language(cfg).enumerate_words(max_length)
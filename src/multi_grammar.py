@@ -0,0 +1,166 @@
+from src.CYK_parser import compile_cnf
+
+
+class MultiGrammar:
+    """
+    Class to encapsulate one recognizer for many CNF grammars. The compiled
+    grammars are merged into a single bitset namespace and one chart per word
+    holds the cells of every grammar, so the word is only looked up and
+    traversed once. Non-terminals deriving the same words by the same rules,
+    within a grammar or across grammars (the lifted terminals of the CNF
+    conversion, shared sub-grammars), get one common bit, so their cells are
+    computed once for all grammars.
+
+    names = the names of the grammars, the keys of a mapping or the list indices
+    start_bits = per grammar, the bit of its start symbol, 0 if it has none
+    start_mask = the bitmask of the start symbols of all grammars
+    terminal_masks = a mapping of Terminal to the merged bitmask producing it
+    """
+
+    def __init__(self, grammars):
+        if hasattr(grammars, "items"):
+            items = list(grammars.items())
+        else:
+            items = list(enumerate(grammars))
+        self.names = tuple(name for name, grammar in items)
+        compiled = [compile_cnf(grammar) for name, grammar in items]
+
+        # every non-terminal of every grammar as (terminals producing it, pairs
+        # of global indices), grammar k owning the indices from offsets[k] on
+        terminals = []
+        pairs = []
+        offsets = []
+        for grammar in compiled:
+            offset = len(terminals)
+            offsets.append(offset)
+            produced = [[] for _ in grammar.non_terminals]
+            for term, mask in grammar.terminal_masks.items():
+                for a in range(len(produced)):
+                    if mask >> a & 1:
+                        produced[a].append(term)
+            terminals += [frozenset(terms) for terms in produced]
+            pairs += [tuple((b + offset, c + offset) for b, c in lhs_pairs) for lhs_pairs in grammar.pairs_by_lhs]
+
+        classes = _equivalence_classes(terminals, pairs)
+        size = max(classes, default=-1) + 1
+
+        self.start_bits = tuple(1 << classes[grammar.start_id + offset] if grammar.start_id is not None else 0
+                                for grammar, offset in zip(compiled, offsets))
+        self.start_mask = 0
+        for bit in self.start_bits:
+            self.start_mask |= bit
+
+        self.terminal_masks = dict()
+        merged_pairs = dict()
+        for var, (terms, lhs_pairs) in enumerate(zip(terminals, pairs)):
+            bit = 1 << classes[var]
+            for term in terms:
+                self.terminal_masks[term] = self.terminal_masks.get(term, 0) | bit
+            for b, c in lhs_pairs:
+                pair = (classes[b], classes[c])
+                merged_pairs[pair] = merged_pairs.get(pair, 0) | bit
+
+        by_left = [[] for _ in range(size)]
+        for (b, c), lhs_mask in sorted(merged_pairs.items()):
+            by_left[b].append((c, lhs_mask))
+        self._by_left = tuple(tuple(entries) for entries in by_left)
+        self._left_any = 0
+        for b, entries in enumerate(by_left):
+            if entries:
+                self._left_any |= 1 << b
+        self._top = 1 << size
+
+        # per terminal, the bits of the grammars using it. A grammar missing a
+        # token of the word cannot accept it, so its bits are masked out.
+        self._support = dict()
+        for grammar, offset in zip(compiled, offsets):
+            owned = 0
+            for a in range(len(grammar.non_terminals)):
+                owned |= 1 << classes[a + offset]
+            for term in grammar.terminal_masks:
+                self._support[term] = self._support.get(term, 0) | owned
+
+    def __len__(self):
+        return len(self.names)
+
+    # the number of bits of the merged namespace, one per class of equivalent
+    # non-terminals
+    def size(self):
+        return len(self._by_left)
+
+    # the bitmask of the start symbols deriving 'word'
+    def accepted_mask(self, word):
+        if len(word) == 0:
+            return 0
+        active = -1
+        for token in set(word):
+            active &= self._support.get(token, 0)
+            if not active:
+                return 0
+
+        terminal_masks = {token: self.terminal_masks[token] & active for token in set(word)}
+        chart = [None]
+        for end in range(1, len(word) + 1):
+            chart.append([0] * end)
+            chart[end][end - 1] = terminal_masks[word[end - 1]]
+            self._fill_column(chart, end)
+        return chart[len(word)][0] & self.start_mask & active
+
+    # _fill_column of the CYK parser for masks thousands of bits wide: every
+    # right cell is turned into a string of its bits once, so testing a bit
+    # is an index instead of an operation on the whole mask
+    def _fill_column(self, chart, end):
+        by_left = self._by_left
+        left_any = self._left_any
+        top = self._top
+        column = chart[end]
+        right_bits = [None] * end
+        for start in range(end - 2, -1, -1):
+            cell = 0
+            for split in range(start + 1, end):
+                left = chart[split][start] & left_any
+                if not left or not column[split]:
+                    continue
+                right = right_bits[split]
+                if right is None:
+                    right = right_bits[split] = bin(column[split] | top)[:2:-1]
+                lefts = bin(left | top)[:2:-1]
+                b = lefts.find("1")
+                while b >= 0:
+                    for c, lhs_mask in by_left[b]:
+                        if right[c] == "1":
+                            cell |= lhs_mask
+                    b = lefts.find("1", b + 1)
+            column[start] = cell
+
+    # the names of the grammars accepting 'word', in catalogue order
+    def accepting(self, word):
+        mask = self.accepted_mask(word)
+        return [name for name, bit in zip(self.names, self.start_bits) if mask & bit]
+
+    # a mapping of every grammar name to whether it accepts 'word'
+    def parse(self, word):
+        mask = self.accepted_mask(word)
+        return {name: mask & bit != 0 for name, bit in zip(self.names, self.start_bits)}
+
+    def accepting_many(self, words):
+        return [self.accepting(word) for word in words]
+
+
+# the class of every non-terminal under the coarsest partition in which
+# members of a class are produced by the same terminals and have rules
+# A -> BC for the same pairs of classes. Such non-terminals derive the same
+# words, by induction on the derivation. The partition is refined from the
+# terminal sets alone until the number of classes is stable.
+def _equivalence_classes(terminals, pairs):
+    ids = dict()
+    classes = [ids.setdefault(terms, len(ids)) for terms in terminals]
+    count = len(ids)
+    while True:
+        ids = dict()
+        refined = [ids.setdefault((classes[var], frozenset((classes[b], classes[c]) for b, c in pairs[var])),
+                                  len(ids)) for var in range(len(classes))]
+        if len(ids) == count:
+            return refined
+        classes = refined
+        count = len(ids)
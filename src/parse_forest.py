@@ -0,0 +1,168 @@
+class SymbolNode:
+    """
+    Class to encapsulate a symbol node of a shared packed parse forest
+
+    var = the NonTerminal derived by this node
+    start, end = the span word[start:end] derived by var
+    packed = a list of PackedNode, one for every alternative derivation
+    """
+
+    def __init__(self, var, start, end):
+        self.var = var
+        self.start = start
+        self.end = end
+        self.packed = []
+
+    def __str__(self):
+        return str(self.var) + "[" + str(self.start) + ":" + str(self.end) + "]"
+
+    def __repr__(self):
+        return str(self)
+
+
+class PackedNode:
+    """
+    Class to encapsulate one alternative derivation of a symbol node
+
+    children = a tuple of the Terminal or the two SymbolNodes the node derives into
+    """
+
+    def __init__(self, children):
+        self.children = children
+
+    def __str__(self):
+        return "(" + ", ".join(str(child) for child in self.children) + ")"
+
+    def __repr__(self):
+        return str(self)
+
+
+class ParseForest:
+    """
+    Class to encapsulate a shared packed parse forest (SPPF) of a word. Every
+    (non-terminal, span) pair has at most one SymbolNode, so sub-derivations
+    are shared and the forest stays polynomial in the length of the word,
+    however many trees it holds.
+
+    root = the SymbolNode of the starting symbol over the entire word
+    nodes = a list of all SymbolNodes, children always come before their parents
+
+    Trees are returned as nested tuples (NonTerminal, children), where children
+    is a tuple of Terminals and subtrees.
+    """
+
+    def __init__(self, root, nodes):
+        self.root = root
+        self.nodes = nodes
+
+    def count(self):
+        counts = dict()
+        for node in self.nodes:
+            total = 0
+            for packed in node.packed:
+                ways = 1
+                for child in packed.children:
+                    if isinstance(child, SymbolNode):
+                        ways *= counts[child]
+                total += ways
+            counts[node] = total
+        return counts[self.root]
+
+    def first_tree(self):
+        return next(self.trees())
+
+    # lazily yields every parse tree, nothing but the current tree is kept
+    def trees(self):
+        return _trees(self.root)
+
+    def __str__(self):
+        ret = ""
+        for node in reversed(self.nodes):
+            ret += str(node) + " -> " + " | ".join(str(packed) for packed in node.packed) + "\n"
+        return ret
+
+
+# the tree picking, at the i-th SymbolNode in preorder, its packed node
+# choices[i]. Missing choices are filled with 0. Returns the tree and the
+# SymbolNodes in preorder. An explicit stack keeps deep trees off the call stack.
+def _build_tree(root, choices):
+    visited = []
+    # frames of [node, children of the chosen packed node, next child, subtrees]
+    stack = [[root, None, 0, []]]
+    while True:
+        frame = stack[-1]
+        node = frame[0]
+        if frame[1] is None:
+            if len(visited) == len(choices):
+                choices.append(0)
+            frame[1] = node.packed[choices[len(visited)]].children
+            visited.append(node)
+
+        children = frame[1]
+        if frame[2] == len(children):
+            tree = (node.var, tuple(frame[3]))
+            stack.pop()
+            if not stack:
+                return tree, visited
+            stack[-1][3].append(tree)
+            continue
+
+        child = children[frame[2]]
+        frame[2] += 1
+        if isinstance(child, SymbolNode):
+            stack.append([child, None, 0, []])
+        else:
+            frame[3].append(child)
+
+
+# every tree of 'root', like nested loops over the packed nodes in preorder:
+# the last choice that has alternatives left is advanced and the choices
+# after it start over
+def _trees(root):
+    choices = []
+    while True:
+        tree, visited = _build_tree(root, choices)
+        yield tree
+        while choices and choices[-1] + 1 == len(visited[len(choices) - 1].packed):
+            choices.pop()
+        if not choices:
+            return
+        choices[-1] += 1
+
+
+# builds the forest of the starting symbol over 'word' from a filled bitset
+# chart, chart[j][i] being the non-terminals deriving word[i:j]. Only nodes
+# that are part of some complete derivation are created.
+def build_forest(compiled, word, chart):
+    length = len(word)
+    if length == 0 or compiled.start_id is None or not chart[length][0] >> compiled.start_id & 1:
+        return None
+
+    nodes = dict()
+    root = SymbolNode(compiled.non_terminals[compiled.start_id], 0, length)
+    nodes[(compiled.start_id, 0, length)] = root
+    worklist = [(compiled.start_id, 0, length)]
+    while worklist:
+        a, start, end = worklist.pop()
+        node = nodes[(a, start, end)]
+        if end - start == 1:
+            node.packed.append(PackedNode((word[start],)))
+            continue
+
+        for split in range(start + 1, end):
+            left = chart[split][start]
+            right = chart[end][split]
+            for b, c in compiled.pairs_by_lhs[a]:
+                if left >> b & 1 and right >> c & 1:
+                    children = []
+                    for key in ((b, start, split), (c, split, end)):
+                        child = nodes.get(key)
+                        if child is None:
+                            child = SymbolNode(compiled.non_terminals[key[0]], key[1], key[2])
+                            nodes[key] = child
+                            worklist.append(key)
+                        children.append(child)
+                    node.packed.append(PackedNode(tuple(children)))
+
+    ordered = sorted(nodes.values(), key=lambda n: n.end - n.start)
+    return ParseForest(root, ordered)
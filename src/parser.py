@@ -1,19 +1,25 @@
 from src.cfg import *
 from src.Error import InputError
+import gzip
+import os
 import re
 
+_lhs_pattern = re.compile(r"[A-Z][0-9]*")
+# a single pass over a rhs yields non-terminals, terminals, lambdas, stray
+# numbers and unknown characters, in that group order
+_rhs_token = re.compile(r"([A-Z][0-9]*)|([a-z])|(&)|([0-9])|(.)", re.DOTALL)
+# the common case of a rhs made of valid variables only
+_rhs_valid = re.compile(r"(?:[A-Z][0-9]*|[a-z])+")
+_rhs_var = re.compile(r"[A-Z][0-9]*|[a-z]")
+
 
 def parse_file(cfg, file):
     path = "../context_free_grammars/" + file
-    with open(path, 'r') as f:
-        for line in f:
-            parse_rule(cfg, line)
+    load_grammar(path, cfg)
 
 
 def parse_file_path(cfg, path):
-    with open(path, 'r') as f:
-        for line in f:
-            parse_rule(cfg, line)
+    load_grammar(path, cfg)
 
 
 def parse_user_input(cfg):
@@ -25,45 +31,62 @@ def parse_user_input(cfg):
             parse_rule(cfg, line)
 
 
+# loads a grammar from a path (files ending in '.gz' are decompressed), an open
+# file or any iterable of lines such as sys.stdin. Every line is parsed before
+# the rules are inserted in bulk, so an invalid line leaves 'cfg' untouched.
+# Blank lines are skipped.
+def load_grammar(source, cfg=None):
+    if cfg is None:
+        cfg = CFG()
+
+    if isinstance(source, (str, os.PathLike)):
+        opener = gzip.open if os.fspath(source).endswith(".gz") else open
+        with opener(source, "rt") as f:
+            return load_grammar(f, cfg)
+
+    cfg.add_rules([rule for line in source if len(line.strip()) != 0 for rule in _parse_line(line)])
+    return cfg
+
+
 def parse_rule(cfg, rule):
-    split = rule.strip().replace(" ", "").split("->")
-    if len(split) != 2:
-        raise InputError(rule, "Rule is not separated by a single arrow: '->'")
+    for new_rule in _parse_line(rule):
+        cfg.add_rule(new_rule)
 
-    lhs = split[0]
-    rhs = split[1].split("|")
 
-    if not re.match(r"[A-Z][0-9]*", lhs):
-        raise InputError(lhs, "LHS does not match specified rule format")
+def _split_rhs(r):
+    if _rhs_valid.fullmatch(r):
+        return [NonTerminal(var) if var[0].isupper() else Terminal(var) for var in _rhs_var.findall(r)]
 
-    for r in rhs:
-        split_rule = []
-        temp = None
-
-        for c in r:
-            if not c.isnumeric() and temp is not None:
-                split_rule.append(NonTerminal(temp))
-                temp = None
-
-            if c.islower():
-                split_rule.append(Terminal(c))
-            elif c.isupper():
-                temp = c
-            elif c.isnumeric():
-                if temp is None:
-                    raise InputError(r, "Number does not follow a non terminal: " + c)
-                else:
-                    temp += c
-            elif c == "&":
-                if len(split_rule) != 0 and len(r) != 1:
-                    raise InputError(r, "Lambda must exist by itself in a rule")
-                else:
-                    split_rule.append(Lambda())
+    split_rule = []
+    for var, term, lam, number, unknown in _rhs_token.findall(r):
+        if var:
+            split_rule.append(NonTerminal(var))
+        elif term:
+            split_rule.append(Terminal(term))
+        elif lam:
+            if len(split_rule) != 0 and len(r) != 1:
+                raise InputError(r, "Lambda must exist by itself in a rule")
             else:
-                raise InputError(r, "Unknown character encountered: " + c)
+                split_rule.append(Lambda())
+        elif number:
+            raise InputError(r, "Number does not follow a non terminal: " + number)
         else:
-            if temp is not None:
-                split_rule.append(NonTerminal(temp))
+            raise InputError(r, "Unknown character encountered: " + unknown)
+    return split_rule
 
-        new_rule = Rule(NonTerminal(lhs), split_rule)
-        cfg.add_rule(new_rule)
+
+# yields the rules of a single line of the CFG format
+def _parse_line(line):
+    if isinstance(line, bytes):
+        line = line.decode()
+    split = line.strip().replace(" ", "").split("->")
+    if len(split) != 2:
+        raise InputError(line, "Rule is not separated by a single arrow: '->'")
+
+    lhs = split[0]
+    if not _lhs_pattern.match(lhs):
+        raise InputError(lhs, "LHS does not match specified rule format")
+
+    lhs = NonTerminal(lhs)
+    for r in split[1].split("|"):
+        yield Rule(lhs, _split_rhs(r))
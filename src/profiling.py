@@ -0,0 +1,132 @@
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
+import contextvars
+import time
+import tracemalloc
+
+PhaseRecord = namedtuple("PhaseRecord", ["name", "depth", "seconds", "rules_before", "rules_after",
+                                         "non_terminals_before", "non_terminals_after",
+                                         "non_terminals_created", "peak_memory"])
+
+# the Profile collecting records, None while profiling is disabled. Every hook
+# checks this first, so disabled instrumentation costs one lookup. Being a
+# context variable, a profile only sees the work of the thread or asyncio task
+# that entered it (and of the tasks that task creates), conversions running
+# in other threads are not recorded.
+_active = contextvars.ContextVar("active_profile", default=None)
+# the open phases of the current thread or task, innermost last
+_open_phases = contextvars.ContextVar("open_phases", default=())
+_disabled = nullcontext()
+
+
+class Profile:
+    """
+    Class to encapsulate the measurements taken while profiling is enabled
+
+    phases = a list of PhaseRecord in the order the phases finished
+    counters = a Counter of named event counts, such as cyk.chart_cells
+    trace_memory = whether peak memory is measured (through tracemalloc, which is
+                   slow and counts the allocations of every thread)
+    callback = called with every PhaseRecord as soon as its phase finishes, or None
+    """
+
+    def __init__(self, trace_memory=False, callback=None):
+        self.phases = []
+        self.counters = Counter()
+        self.trace_memory = trace_memory
+        self.callback = callback
+
+    def _add(self, record):
+        self.phases.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def __str__(self):
+        ret = "%-28s %10s %9s %9s %9s %12s\n" % ("phase", "seconds", "rules", "->", "new vars", "peak bytes")
+        for record in self.phases:
+            ret += "%-28s %10.5f %9d %9d %9d %12s\n" % ("  " * record.depth + record.name, record.seconds,
+                                                       record.rules_before, record.rules_after,
+                                                       record.non_terminals_created,
+                                                       "-" if record.peak_memory is None else record.peak_memory)
+        for name, count in sorted(self.counters.items()):
+            ret += name + ": " + str(count) + "\n"
+        return ret
+
+
+def _count_rules(cfg):
+    return sum(len(rules) for rules in cfg.production_rules.values())
+
+
+class _Phase:
+    def __init__(self, profile, name, cfg):
+        self.profile = profile
+        self.name = name
+        self.cfg = cfg
+        self.child_peak = 0
+
+    def __enter__(self):
+        self.rules_before = _count_rules(self.cfg)
+        self.non_terminals_before = set(self.cfg.non_terminals)
+        if self.profile.trace_memory:
+            self.memory_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.parent = _open_phases.get()
+        self._token = _open_phases.set(self.parent + (self,))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        _open_phases.reset(self._token)
+        peak = None
+        if self.profile.trace_memory:
+            # nested phases reset the tracemalloc peak, so theirs is passed up
+            absolute_peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak = absolute_peak - self.memory_before
+            if self.parent:
+                parent = self.parent[-1]
+                parent.child_peak = max(parent.child_peak, absolute_peak)
+
+        self.profile._add(PhaseRecord(self.name, len(self.parent), seconds,
+                                      self.rules_before, _count_rules(self.cfg),
+                                      len(self.non_terminals_before), len(self.cfg.non_terminals),
+                                      len(self.cfg.non_terminals - self.non_terminals_before), peak))
+        return False
+
+
+# enables profiling for the duration of the with block and yields the Profile
+# that collects the phases and counters
+@contextmanager
+def profile(trace_memory=False, callback=None):
+    active = Profile(trace_memory, callback)
+    token = _active.set(active)
+    phases_token = _open_phases.set(())
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield active
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _open_phases.reset(phases_token)
+        _active.reset(token)
+
+
+def enabled():
+    return _active.get() is not None
+
+
+# a context manager measuring a phase of work on 'cfg', a no-op while
+# profiling is disabled
+def phase(name, cfg):
+    active = _active.get()
+    if active is None:
+        return _disabled
+    return _Phase(active, name, cfg)
+
+
+def count(name, n=1):
+    active = _active.get()
+    if active is not None:
+        active.counters[name] += n
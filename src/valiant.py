@@ -0,0 +1,162 @@
+from src.bitset import iter_bits
+
+
+# Valiant's reduction of CFG recognition to boolean matrix multiplication, in
+# the divide and conquer formulation of Okhotin ("Parsing by matrix
+# multiplication generalized to Boolean grammars", 2014). The chart is split
+# into one boolean matrix per non-terminal, T[A][i] is the row bitset of A:
+# bit j is set if A derives word[i:j]. The positions are padded to a power of
+# two, padding tokens derive nothing.
+#
+# compute(l, m) fills every cell of the chart between positions l and m.
+# complete(l, m, l2, m2) fills the block of rows [l, m) and columns [l2, m2)
+# when all products T[i, k] x T[k, j] with k in [m, l2) are already in it,
+# splitting it into four quarters that are completed one after the other.
+# A product X x Y of two blocks adds A to cell (i, j) for every rule A -> BC
+# with B in X[i, k] and C in Y[k, j].
+#
+# Valiant's bound needs a sub-cubic boolean matrix product. Strassen-like
+# products do not pay off on Python ints, so wide blocks are multiplied with
+# the Four Russians method: O(|G| n^3 / (w log n)) for n positions and w bit
+# words, a log n factor under the bitset CYK. The recursion itself costs
+# O(n^2) calls on tiny blocks. Up to a few hundred tokens those calls
+# dominate, so the real gain over the bitset chart is a constant factor on
+# long words, see benchmarks/valiant_crossover.py.
+
+# blocks narrower than this are multiplied naively, their tables would cost
+# more than they save
+_RUSSIANS_MIN_WIDTH = 16
+# the largest chunk of the Four Russians product, tables have 2^bits entries
+_RUSSIANS_MAX_BITS = 8
+
+
+def _range_mask(start, end):
+    return ((1 << (end - start)) - 1) << start
+
+
+class _ValiantChart:
+    def __init__(self, compiled, word):
+        self.word = word
+        self.terminal_masks = compiled.terminal_masks
+        self.size = 2
+        while self.size < len(word) + 1:
+            self.size *= 2
+        self.rows = [[0] * self.size for _ in range(len(compiled.non_terminals))]
+        # per B: the (C, lhs ids) of all rules A -> BC
+        by_left = dict()
+        for (b, c), lhs_mask in compiled.pair_masks.items():
+            by_left.setdefault(b, []).append((c, tuple(iter_bits(lhs_mask))))
+        self.by_left = sorted(by_left.items())
+
+    def multiply(self, rows, inner, cols):
+        width = inner[1] - inner[0]
+        if width < _RUSSIANS_MIN_WIDTH:
+            self._multiply_naive(rows, inner, cols)
+            return
+
+        # Four Russians: the inner range is cut into chunks of 'bits' split
+        # points. For every C and chunk, a table holds the OR of the rows of C
+        # for each of the 2^bits subsets of the chunk, so a row of the product
+        # takes one lookup per chunk instead of one OR per split point.
+        # Tables are built on first use and shared by every B and row.
+        bits = min(_RUSSIANS_MAX_BITS, width.bit_length() - 1)
+        chunk_mask = (1 << bits) - 1
+        inner_mask = (1 << width) - 1
+        col_mask = _range_mask(*cols)
+        tables = dict()
+        for b, entries in self.by_left:
+            row_b = self.rows[b]
+            for i in range(*rows):
+                splits = row_b[i] >> inner[0] & inner_mask
+                if not splits:
+                    continue
+                for c, lhs_ids in entries:
+                    chunks = tables.get(c)
+                    if chunks is None:
+                        chunks = tables[c] = [None] * ((width + bits - 1) // bits)
+                    acc = 0
+                    rest = splits
+                    chunk = 0
+                    while rest:
+                        subset = rest & chunk_mask
+                        if subset:
+                            table = chunks[chunk]
+                            if table is None:
+                                table = chunks[chunk] = self._subset_table(c, inner[0] + chunk * bits,
+                                                                           min(bits, width - chunk * bits), col_mask)
+                            acc |= table[subset]
+                        rest >>= bits
+                        chunk += 1
+                    if acc:
+                        for a in lhs_ids:
+                            self.rows[a][i] |= acc
+
+    # the OR of the rows start .. start + bits - 1 of C, restricted to
+    # 'col_mask', for every subset of them
+    def _subset_table(self, c, start, bits, col_mask):
+        row_c = self.rows[c]
+        table = [0] * (1 << bits)
+        for bit in range(bits):
+            row = row_c[start + bit] & col_mask
+            step = 1 << bit
+            for subset in range(step):
+                table[step | subset] = table[subset] | row
+        return table
+
+    def _multiply_naive(self, rows, inner, cols):
+        inner_mask = _range_mask(*inner)
+        col_mask = _range_mask(*cols)
+        for b, entries in self.by_left:
+            row_b = self.rows[b]
+            for i in range(*rows):
+                splits = row_b[i] & inner_mask
+                if not splits:
+                    continue
+                splits = list(iter_bits(splits))
+                for c, lhs_ids in entries:
+                    row_c = self.rows[c]
+                    acc = 0
+                    for k in splits:
+                        acc |= row_c[k]
+                    acc &= col_mask
+                    if acc:
+                        for a in lhs_ids:
+                            self.rows[a][i] |= acc
+
+    def complete(self, l, m, l2, m2):
+        if m - l == 1:
+            # a single cell, off the diagonal all its products are already in it
+            if m == l2 and l < len(self.word):
+                for a in iter_bits(self.terminal_masks.get(self.word[l], 0)):
+                    self.rows[a][l] |= 1 << m
+            return
+
+        mid = (l + m) // 2
+        mid2 = (l2 + m2) // 2
+        self.complete(mid, m, l2, mid2)
+        self.multiply((l, mid), (mid, m), (l2, mid2))
+        self.complete(l, mid, l2, mid2)
+        self.multiply((mid, m), (l2, mid2), (mid2, m2))
+        self.complete(mid, m, mid2, m2)
+        self.multiply((l, mid), (mid, m), (mid2, m2))
+        self.multiply((l, mid), (l2, mid2), (mid2, m2))
+        self.complete(l, mid, mid2, m2)
+
+    def compute(self, l, m):
+        mid = (l + m) // 2
+        if m - l >= 4:
+            self.compute(l, mid)
+            self.compute(mid, m)
+        self.complete(l, mid, mid, m)
+
+
+def valiant_chart(compiled, word):
+    chart = _ValiantChart(compiled, word)
+    chart.compute(0, chart.size)
+    return chart.rows
+
+
+def valiant_parse(compiled, word):
+    if len(word) == 0 or compiled.start_id is None:
+        return False
+    return valiant_chart(compiled, word)[compiled.start_id][0] >> len(word) & 1 == 1
@@ -1,7 +1,10 @@
+import threading
 import unittest
 from src.parser import *
 from src.cfg_modify import *
 from src.chomsky import *
+from src.CYK_parser import cyk_parser
+import src.profiling
 
 
 test_path = "../context_free_grammars/tests/"
@@ -55,6 +58,12 @@ class TestParseMethods(unittest.TestCase):
         erasables = get_erasable_vars(self.cfg)
         self.assertSetEqual(erasables, {self.A, self.B, self.C})
 
+    def test_productive_reachable(self):
+        parse_file(self.cfg, "erasable_test.txt")
+        parse_rule(self.cfg, "D -> Db | AD")
+        self.assertSetEqual(get_productive_vars(self.cfg), {self.A, self.B, self.C, self.S})
+        self.assertSetEqual(get_reachable_vars(self.cfg), {self.A, self.B, self.C, self.S})
+
     def test_lambda_removal(self):
         parse_file(self.cfg, "lambda_removal.txt")
         remove_lambdas(self.cfg)
@@ -72,6 +81,27 @@ class TestParseMethods(unittest.TestCase):
         for key, rules in self.cfg.production_rules.items():
             self.assertFalse(Rule(key, [Lambda()]) in rules)
 
+    def test_lambda_removal_binarized(self):
+        parse_rule(self.cfg, "S -> " + "A" * 24 + "b")
+        parse_rule(self.cfg, "A -> a | &")
+        remove_lambdas(self.cfg, binarize=True)
+        rule_count = sum(len(rules) for rules in self.cfg.production_rules.values())
+        self.assertLess(rule_count, 100)
+        for key, rules in self.cfg.production_rules.items():
+            self.assertFalse(Rule(key, [Lambda()]) in rules)
+            for rule in rules:
+                self.assertLessEqual(len(rule.rhs), 2)
+
+    def test_binarize_rules_deterministic(self):
+        parse_rule(self.cfg, "S -> BCDA | ABCD")
+        binarize_rules(self.cfg)
+        # the rules are split in sorted order, names count up from the 5 symbols taken
+        bin5 = NonTerminal("_BIN5")
+        bin7 = NonTerminal("_BIN7")
+        self.assertSetEqual(self.cfg.production_rules[self.S], {Rule(self.S, [self.A, bin5]),
+                                                                Rule(self.S, [self.B, bin7])})
+        self.assertSetEqual(self.cfg.production_rules[bin5], {Rule(bin5, [self.B, NonTerminal("_BIN6")])})
+
     def test_unit_rule_removal(self):
         parse_file(self.cfg, "unit_rule_removal.txt")
         remove_unit_rules(self.cfg)
@@ -99,12 +129,111 @@ class TestParseMethods(unittest.TestCase):
         remove_useless_vars(self.cfg)
         self._compare_cfgs()
 
+    def test_reduce_grammar(self):
+        parse_file_path(self.cfg, test_path + "non_productives.txt")
+        report = reduce_grammar(self.cfg)
+        self.assertIs(report.cfg, self.cfg)
+        self.assertSetEqual(report.non_productive, {self.B, self.D})
+        self.assertSetEqual(report.unreachable, {self.A})
+        self.assertSetEqual(report.removed_terminals, {self.c})
+        self.assertEqual(report.rules_removed, 5)
+        self.assertSetEqual(set(self.cfg.production_rules), {self.S})
+        self.assertSetEqual(self.cfg.non_terminals, {self.S})
+        self.assertSetEqual(self.cfg.terminals, {self.a, self.b})
+
     def test_no_lambda_unit(self):
         self._load_cfgs("no_lambda_unit")
         remove_lambdas(self.cfg)
         remove_unit_rules(self.cfg)
         self._compare_cfgs()
 
+    def test_profiling(self):
+        parse_file(self.cfg, "chomsky.txt")
+        with src.profiling.profile(trace_memory=True) as profile:
+            transform_to_CNF(self.cfg)
+            cyk_parser(self.cfg, [self.a, self.c])
+        names = [record.name for record in profile.phases]
+        self.assertListEqual(names, ["remove_lambdas", "remove_unit_rules", "lift_terminals", "split_rules",
+                                     "transform_to_CNF"])
+        split = profile.phases[3]
+        self.assertGreater(split.non_terminals_created, 0)
+        self.assertEqual(split.depth, 1)
+        self.assertGreaterEqual(profile.phases[4].peak_memory, split.peak_memory)
+        self.assertEqual(profile.counters["cyk.chart_cells"], 3)
+        self.assertFalse(src.profiling.enabled())
+
+    def test_profiling_per_thread(self):
+        parse_file(self.cfg, "chomsky.txt")
+        other = CFG()
+        parse_file(other, "chomsky.txt")
+        third = CFG()
+        parse_file(third, "chomsky.txt")
+        records = dict()
+
+        def convert_profiled():
+            with src.profiling.profile() as profile:
+                transform_to_CNF(other)
+            records["thread"] = profile.phases
+
+        with src.profiling.profile() as profile:
+            with src.profiling.phase("outer", self.cfg):
+                for target in (convert_profiled, lambda: transform_to_CNF(third)):
+                    thread = threading.Thread(target=target)
+                    thread.start()
+                    thread.join()
+                transform_to_CNF(self.cfg)
+        self.assertListEqual([record.name for record in profile.phases],
+                             ["remove_lambdas", "remove_unit_rules", "lift_terminals", "split_rules",
+                              "transform_to_CNF", "outer"])
+        self.assertListEqual([record.depth for record in profile.phases], [2, 2, 2, 2, 1, 0])
+        self.assertListEqual([record.depth for record in records["thread"]], [1, 1, 1, 1, 0])
+
+    def test_minimal_chomsky_transform(self):
+        parse_rule(self.cfg, "S -> aABC | bABC | CAB")
+        parse_rule(self.cfg, "A -> a")
+        parse_rule(self.cfg, "B -> bD | a")
+        parse_rule(self.cfg, "C -> c")
+        parse_rule(self.cfg, "D -> bD | a")
+        report = transform_to_minimal_CNF(self.cfg)
+        self.assertEqual(report.suffixes_shared, 1)
+        # D into B, and the lifted terminals a and c into A and C
+        self.assertEqual(report.non_terminals_merged, 3)
+        self.assertLess(report.rules, report.plain_rules)
+        self.assertEqual(report.rules, sum(len(rules) for rules in self.cfg.production_rules.values()))
+        self.assertNotIn(NonTerminal("D"), self.cfg.non_terminals)
+        self.assertNotIn(NonTerminal("_CHOMSKYa"), self.cfg.non_terminals)
+        for rules in self.cfg.production_rules.values():
+            for rule in rules:
+                self.assertTrue(len(rule.rhs) == 2 or isinstance(rule.rhs[0], Terminal))
+        self.assertTrue(cyk_parser(self.cfg, [self.b, self.a, self.b, self.b, self.a, self.c]))
+        self.assertFalse(cyk_parser(self.cfg, [self.b, self.a, self.b, self.b, self.c]))
+
+    def test_chomsky_copy_deterministic(self):
+        parse_file(self.cfg, "chomsky.txt")
+        self.cfg.add_rule(Rule(NonTerminal("_CHOMSKY_RULE1"), [self.a, self.b]))
+        rules = {key: set(value) for key, value in self.cfg.production_rules.items()}
+        first = transform_to_CNF(self.cfg, in_place=False)
+        second = transform_to_CNF(self.cfg, in_place=False)
+        self.assertDictEqual({key: set(value) for key, value in self.cfg.production_rules.items()}, rules)
+        self.assertDictEqual(first.production_rules, second.production_rules)
+        self.assertIn(Rule(NonTerminal("_CHOMSKY_RULE1"), [NonTerminal("_CHOMSKYa"), NonTerminal("_CHOMSKYb")]),
+                      first.production_rules[NonTerminal("_CHOMSKY_RULE1")])
+        self.assertEqual(len(first.production_rules[NonTerminal("_CHOMSKY_RULE1")]), 1)
+
+    def test_copy_on_write(self):
+        self._load_cfgs("useless_var")
+        rules = {key: set(value) for key, value in self.cfg.production_rules.items()}
+        non_terminals = set(self.cfg.non_terminals)
+        result = remove_useless_vars(self.cfg, in_place=False)
+        self.assertDictEqual({key: set(value) for key, value in self.cfg.production_rules.items()}, rules)
+        self.assertSetEqual(self.cfg.non_terminals, non_terminals)
+        self.cfg, original = result, self.cfg
+        self._compare_cfgs()
+        # productions the pass did not change are shared, not copied
+        for key, value in result.production_rules.items():
+            if value == rules[key]:
+                self.assertIs(value, original.production_rules[key])
+
     def test_chomsky_transform(self):
         parse_file(self.cfg, "chomsky.txt")
         transform_to_CNF(self.cfg)
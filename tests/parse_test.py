@@ -1,7 +1,31 @@
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import gzip
+import io
+import itertools
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
 import unittest
 from src.parser import *
 from src.cfg import CFG
+from src.Error import InputError
 import src.CYK_parser
+import src.async_recognizer
+import src.batch_parser
+import src.cfg_modify
+import src.cyk_numpy
+import src.earley_parser
+import src.glr_parser
+import src.grammar_cache
+import src.language
+import src.multi_grammar
+from src.chomsky import transform_to_CNF
 
 
 test_path = "../context_free_grammars/tests/"
@@ -37,6 +61,91 @@ class TestParseMethods(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             parse_file(cfg, "not_found")
 
+    def test_interned_symbols(self):
+        self.assertIs(NonTerminal("A"), self.A)
+        self.assertIs(copy.deepcopy(self.a), self.a)
+        self.assertIs(Lambda(), Lambda())
+        self.assertNotEqual(Terminal("A"), self.A)
+        rule = Rule(self.S, [self.A, self.a])
+        self.assertEqual(rule, Rule(self.S, (self.A, self.a)))
+        self.assertIs(copy.deepcopy(rule).rhs[0], self.A)
+        with self.assertRaises(AttributeError):
+            rule.lhs = self.B
+
+    def test_load_grammar(self):
+        lines = ["S -> AB", "", "A -> BB | a\n", "B -> AB | b"]
+        cfg = load_grammar(lines)
+        self.assertEqual(cfg.start_var, self.S)
+        self.assertSetEqual(cfg.terminals, {self.a, self.b})
+        self._load_cfg("cyk_parser_simple")
+        self.assertEqual(cfg.production_rules, self.cfg.production_rules)
+        self.assertEqual(cfg._refs, self.cfg._refs)
+
+    def test_load_grammar_gzip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "grammar.txt.gz")
+            with gzip.open(path, "wt") as f:
+                f.write("S -> aSb | &\n")
+            cfg = load_grammar(path)
+        self.assertSetEqual(cfg.production_rules[self.S], {Rule(self.S, [self.a, self.S, self.b]),
+                                                           Rule(self.S, [Lambda()])})
+        with self.assertRaises(InputError):
+            load_grammar(io.StringIO("S -> a1"))
+
+    def test_load_grammar_invalid_line(self):
+        with self.assertRaises(InputError):
+            load_grammar(["S -> aA", "A -> b", "B -> 1"], self.cfg)
+        self.assertEqual(len(self.cfg.production_rules), 0)
+        self.assertEqual(len(self.cfg.non_terminals), 0)
+
+        def rules():
+            yield Rule(self.S, [self.a, self.A])
+            raise InputError("B -> 1", "Number does not follow a non terminal: 1")
+
+        with self.assertRaises(InputError):
+            self.cfg.add_rules(rules())
+        self.assertSetEqual(self.cfg.non_terminals, {self.S, self.A})
+        self.assertSetEqual(self.cfg.terminals, {self.a})
+        self.assertSetEqual(self.cfg._refs[self.A], {Rule(self.S, [self.a, self.A])})
+
+    def test_cfg_serialization(self):
+        parse_file(self.cfg, "chomsky.txt")
+        transform_to_CNF(self.cfg)
+        loaded = src.grammar_cache.loads_cfg(src.grammar_cache.dumps_cfg(self.cfg))
+        self.assertEqual(loaded.production_rules, self.cfg.production_rules)
+        self.assertSetEqual(loaded.terminals, self.cfg.terminals)
+        self.assertSetEqual(loaded.non_terminals, self.cfg.non_terminals)
+        self.assertEqual(loaded.start_var, self.cfg.start_var)
+        self.assertEqual(loaded._refs, self.cfg._refs)
+
+    def test_cached_cnf(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = test_path + "cyk_parser_simple1.txt"
+            cnf = src.grammar_cache.cached_cnf(path, directory)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            cached = src.grammar_cache.cached_cnf(path, directory)
+            self.assertEqual(cached.production_rules, cnf.production_rules)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            src.grammar_cache.cached_grammar(path, cache_dir=directory)
+            self.assertEqual(len(os.listdir(directory)), 2)
+        word = [self.a, self.c, self.a, self.c, self.c]
+        self.assertTrue(src.CYK_parser.cyk_parser(cached, word))
+
+    def test_cached_grammar_pipelines(self):
+        path = "../context_free_grammars/lambda_removal.txt"
+        with tempfile.TemporaryDirectory() as directory:
+            plain = src.grammar_cache.cached_grammar(path, (src.cfg_modify.remove_lambdas,), directory)
+            binarized = src.grammar_cache.cached_grammar(
+                path, (functools.partial(src.cfg_modify.remove_lambdas, binarize=True),), directory)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertNotEqual(binarized.production_rules, plain.production_rules)
+            cached = src.grammar_cache.cached_grammar(
+                path, (functools.partial(src.cfg_modify.remove_lambdas, binarize=True),), directory)
+            self.assertEqual(cached.production_rules, binarized.production_rules)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            with self.assertRaises(ValueError):
+                src.grammar_cache.cached_grammar(path, (lambda cfg: None,), directory)
+
     def test_cyk_parser(self):
         self._load_cfg("cyk_parser_simple")
         word = [self.a, self.b, self.b, self.b]
@@ -52,6 +161,290 @@ class TestParseMethods(unittest.TestCase):
         word = [self.a, self.c, self.a, self.c, self.c]
         self.assertTrue(src.CYK_parser.cyk_parser(self.cfg, word))
 
+    def test_bitset_cyk_parser(self):
+        self._load_cfg("cyk_parser_simple1")
+        self.assertFalse(src.CYK_parser.bitset_cyk_parser(self.cfg, [self.a, self.c, self.a, self.c]))
+        self.assertTrue(src.CYK_parser.bitset_cyk_parser(self.cfg, [self.a, self.c, self.a, self.c, self.c]))
+
+    def test_bitset_cyk_matches_cyk(self):
+        for name in ["cyk_parser_simple", "cyk_parser_simple1"]:
+            self.cfg = CFG()
+            self._load_cfg(name)
+            for length in range(1, 7):
+                for word in itertools.product([self.a, self.b, self.c], repeat=length):
+                    word = list(word)
+                    self.assertEqual(src.CYK_parser.bitset_cyk_parser(self.cfg, word),
+                                     src.CYK_parser.cyk_parser(self.cfg, word), str(word))
+
+    def test_compiled_cnf(self):
+        self._load_cfg("cyk_parser_simple1")
+        compiled = src.CYK_parser.CompiledCNF(self.cfg)
+        self.assertEqual(compiled.non_terminals[compiled.start_id], self.A)
+        self.assertEqual(compiled.terminal_masks[self.a], 1 << compiled.ids[self.B])
+        words = [[self.a, self.c, self.a, self.c], [self.a, self.c, self.a, self.c, self.c], []]
+        self.assertListEqual(compiled.parse_many(words), [False, True, False])
+
+    def test_parse_batch(self):
+        self._load_cfg("cyk_parser_simple1")
+        words = [list(word) for length in range(1, 6)
+                 for word in itertools.product([self.a, self.c], repeat=length)]
+        expected = [src.CYK_parser.cyk_parser(self.cfg, word) for word in words]
+        result = list(src.batch_parser.parse_batch(self.cfg, words, workers=2, chunk_size=5))
+        self.assertListEqual(result, expected)
+
+    def test_async_recognizer(self):
+        self._load_cfg("cyk_parser_simple1")
+        words = [list(word) for length in range(1, 6)
+                 for word in itertools.product([self.a, self.c], repeat=length)]
+        expected = [src.CYK_parser.cyk_parser(self.cfg, word) for word in words]
+
+        async def recognize_all():
+            async with src.async_recognizer.AsyncRecognizer(self.cfg, workers=2, max_batch=8,
+                                                            max_queue=4) as recognizer:
+                results = await asyncio.gather(*(recognizer.recognize(word) for word in words))
+                return results, recognizer.latency_percentiles((50, 100))
+
+        results, latencies = asyncio.run(recognize_all())
+        self.assertListEqual(results, expected)
+        self.assertLessEqual(latencies[50], latencies[100])
+
+    def test_earley_parser(self):
+        parse_file(self.cfg, "lambda_removal.txt")
+        self.assertTrue(src.earley_parser.earley_parser(self.cfg, [self.a]))
+        self.assertTrue(src.earley_parser.earley_parser(self.cfg, [self.b, self.b, self.a, self.d]))
+        self.assertFalse(src.earley_parser.earley_parser(self.cfg, [self.b, self.d]))
+        self.assertFalse(src.earley_parser.earley_parser(self.cfg, []))
+
+    def test_earley_matches_cyk(self):
+        parse_file(self.cfg, "erasable_test.txt")
+        cnf = copy.deepcopy(self.cfg)
+        transform_to_CNF(cnf)
+        for length in range(1, 6):
+            for word in itertools.product([self.a, self.b, self.c, self.d], repeat=length):
+                word = list(word)
+                self.assertEqual(src.earley_parser.earley_parser(self.cfg, word),
+                                 src.CYK_parser.cyk_parser(cnf, word), str(word))
+
+    def test_cyk_parse_forest(self):
+        parse_rule(self.cfg, "S -> SS | a")
+        forest = src.CYK_parser.cyk_parser(self.cfg, [self.a] * 8, forest=True)
+        # catalan number, while the forest only has one node per (symbol, span)
+        self.assertEqual(forest.count(), 429)
+        self.assertEqual(len(forest.nodes), 36)
+        self.assertEqual(sum(1 for _ in forest.trees()), 429)
+        self.assertEqual(forest.first_tree()[0], self.S)
+        self.assertIsNone(src.CYK_parser.cyk_parser(self.cfg, [self.a, self.b], forest=True))
+
+    def test_parse_forest_long_word(self):
+        parse_rule(self.cfg, "S -> AS | a")
+        parse_rule(self.cfg, "A -> a")
+        forest = src.CYK_parser.cyk_parser(self.cfg, [self.a] * 400, forest=True)
+        trees = list(forest.trees())
+        self.assertEqual(len(trees), 1)
+        tree = forest.first_tree()
+        self.assertEqual(tree, trees[0])
+        depth = 1
+        while len(tree[1]) == 2:
+            tree = tree[1][1]
+            depth += 1
+        self.assertEqual(depth, 400)
+
+    def test_compiled_cnf_span_cache(self):
+        self._load_cfg("cyk_parser_simple1")
+        compiled = src.CYK_parser.CompiledCNF(self.cfg, cache_size=4)
+        uncached = src.CYK_parser.CompiledCNF(self.cfg)
+        words = [list(word) for length in range(1, 7)
+                 for word in itertools.product([self.a, self.c], repeat=length)]
+        self.assertListEqual(compiled.parse_many(words), uncached.parse_many(words))
+        self.assertListEqual(compiled.parse_many(words), uncached.parse_many(words))
+        info = compiled.cache_info()
+        self.assertGreater(info.hits, 0)
+        self.assertEqual(info.currsize, 4)
+        self.assertIsNone(uncached.cache_info())
+
+    def test_span_cache_repeated_fragments(self):
+        self._load_cfg("cyk_parser_simple1")
+        compiled = src.CYK_parser.CompiledCNF(self.cfg, cache_size=100, max_span=4)
+        uncached = src.CYK_parser.CompiledCNF(self.cfg)
+        fragments = [[self.a, self.c], [self.a, self.c, self.c], [self.c, self.a]]
+        rng = random.Random(0)
+        words = [[token for _ in range(12) for token in rng.choice(fragments)] for _ in range(10)]
+        self.assertListEqual(compiled.parse_many(words), uncached.parse_many(words))
+        info = compiled.cache_info()
+        # only spans of up to 4 tokens over 2 terminals are cached, the rest repeats
+        self.assertLessEqual(info.currsize, 2 + 4 + 8 + 16)
+        self.assertGreater(info.hits, 10 * info.misses)
+
+    def test_span_cache_threads(self):
+        self._load_cfg("cyk_parser_simple1")
+        compiled = src.CYK_parser.CompiledCNF(self.cfg, cache_size=3, max_span=4)
+        words = [list(word) for length in range(1, 9)
+                 for word in itertools.product([self.a, self.c], repeat=length)]
+        expected = src.CYK_parser.CompiledCNF(self.cfg).parse_many(words)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(compiled.parse_many, [words] * 8))
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertListEqual(results, [expected] * 8)
+        copied = pickle.loads(pickle.dumps(compiled))
+        self.assertListEqual(copied.parse_many(words), expected)
+
+    @unittest.skipIf(src.cyk_numpy.np is None, "numpy is not installed")
+    def test_numpy_backend(self):
+        self._load_cfg("cyk_parser_simple")
+        compiled = src.CYK_parser.CompiledCNF(self.cfg)
+        words = [list(word) for length in range(0, 8)
+                 for word in itertools.product([self.a, self.b], repeat=length)]
+        self.assertListEqual(compiled.parse_many(words, backend="numpy"), compiled.parse_many(words))
+        with self.assertRaises(ValueError):
+            compiled.parse([self.a], backend="unknown")
+
+    def test_valiant_backend(self):
+        for name in ["cyk_parser_simple", "cyk_parser_simple1"]:
+            self.cfg = CFG()
+            self._load_cfg(name)
+            compiled = src.CYK_parser.CompiledCNF(self.cfg)
+            words = [list(word) for length in range(0, 8)
+                     for word in itertools.product([self.a, self.b, self.c], repeat=length)]
+            self.assertListEqual(compiled.parse_many(words, backend="valiant"), compiled.parse_many(words))
+
+        # long enough for the Four Russians product on the wide blocks
+        parse_rule(self.cfg_result, "S -> SS | AB | AC")
+        parse_rule(self.cfg_result, "C -> SB")
+        parse_rule(self.cfg_result, "A -> a")
+        parse_rule(self.cfg_result, "B -> b")
+        compiled = src.CYK_parser.CompiledCNF(self.cfg_result)
+        rng = random.Random(0)
+        pieces = [[self.a, self.b], [self.a, self.a, self.b, self.b], [self.a, self.b, self.a, self.b]]
+        words = [[token for _ in range(rng.randint(10, 20)) for token in rng.choice(pieces)] for _ in range(10)]
+        for word in words[::2]:
+            word[rng.randrange(len(word))] = self.a
+        expected = compiled.parse_many(words)
+        self.assertIn(True, expected)
+        self.assertIn(False, expected)
+        self.assertListEqual(compiled.parse_many(words, backend="valiant"), expected)
+
+    def test_glr_parser(self):
+        parse_file(self.cfg, "lambda_removal.txt")
+        tables = src.glr_parser.GLRTables(self.cfg)
+        for length in range(0, 6):
+            for word in itertools.product([self.a, self.b, self.c, self.d], repeat=length):
+                word = list(word)
+                self.assertEqual(src.glr_parser.glr_parser(tables, word),
+                                 src.earley_parser.earley_parser(self.cfg, word), str(word))
+
+    def test_glr_ambiguous(self):
+        parse_rule(self.cfg, "S -> SS | SSS | A | a")
+        parse_rule(self.cfg, "A -> S")
+        tables = src.glr_parser.GLRTables(self.cfg)
+        self.assertGreater(tables.conflicts(), 0)
+        self.assertTrue(src.glr_parser.glr_parser(tables, [self.a] * 30))
+        self.assertFalse(src.glr_parser.glr_parser(tables, [self.a] * 10 + [self.b]))
+        self.assertFalse(src.glr_parser.glr_parser(tables, []))
+
+    def test_cached_glr_tables(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = test_path + "cyk_parser_simple1.txt"
+            tables = src.grammar_cache.cached_glr_tables(path, directory)
+            cached = src.grammar_cache.cached_glr_tables(path, directory)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(cached.reductions, tables.reductions)
+        word = [self.a, self.c, self.a, self.c, self.c]
+        self.assertTrue(src.glr_parser.glr_parser(cached, word))
+        self.assertFalse(src.glr_parser.glr_parser(cached, word[:-1]))
+
+    def test_language_enumeration(self):
+        parse_rule(self.cfg, "S -> aSb | &")
+        language = src.language.Language(self.cfg)
+        self.assertIsNone(language.max_word_length())
+        words = list(itertools.islice(language.enumerate_words(), 4))
+        self.assertListEqual(words, [[self.a] * n + [self.b] * n for n in range(4)])
+        self.assertListEqual(list(language.enumerate_words(max_length=3)), words[:2])
+        self.assertEqual(language.count_derivations(10), 1)
+        self.assertEqual(language.count_words(11), 0)
+
+    def test_language_counting_and_sampling(self):
+        parse_rule(self.cfg, "S -> SS | a | b")
+        language = src.language.Language(self.cfg)
+        words = list(language.words_of_length(3))
+        self.assertEqual(len(words), 8)
+        self.assertListEqual(words, sorted(words, key=lambda word: "".join(map(str, word))))
+        self.assertEqual(language.count_words(3), 8)
+        self.assertEqual(language.count_derivations(3), 16)
+        rng = random.Random(0)
+        for _ in range(20):
+            self.assertIn(language.sample_word(3, rng), words)
+        self.assertIsNone(language.sample_word(0, rng))
+
+        parse_rule(self.cfg_result, "S -> aA | b")
+        parse_rule(self.cfg_result, "A -> c | d")
+        finite = src.language.Language(self.cfg_result)
+        self.assertEqual(finite.max_word_length(), 2)
+        self.assertEqual(len(list(finite.enumerate_words())), 3)
+
+    def test_multi_grammar(self):
+        grammars = dict()
+        for name in ["cyk_parser_simple", "cyk_parser_simple1"]:
+            grammars[name] = CFG()
+            parse_file_path(grammars[name], test_path + name + ".txt")
+        parse_rule(self.cfg, "S -> SS | a | b")
+        grammars["pairs"] = transform_to_CNF(self.cfg)
+        parse_rule(self.cfg_result, "S -> AB")
+        parse_rule(self.cfg_result, "A -> c")
+        parse_rule(self.cfg_result, "B -> d")
+        grammars["cd"] = self.cfg_result
+        grammars["copy"] = grammars["pairs"].copy()
+
+        multi = src.multi_grammar.MultiGrammar(grammars)
+        self.assertEqual(len(multi), 5)
+        self.assertEqual(multi.start_bits[2], multi.start_bits[4])
+        terminals = [self.a, self.b, self.c, self.d]
+        for length in range(1, 5):
+            for word in itertools.product(terminals, repeat=length):
+                word = list(word)
+                expected = [name for name, cfg in grammars.items() if src.CYK_parser.cyk_parser(cfg, word)]
+                self.assertListEqual(multi.accepting(word), expected)
+        self.assertListEqual(multi.accepting([self.c, self.d]), ["cd"])
+        self.assertFalse(any(multi.parse([]).values()))
+
+    def test_benchmark_words_reproducible(self):
+        script = ("import random\n"
+                  "from benchmarks.run import CASES, _load_lines, _words\n"
+                  "from benchmarks.grammar_gen import generate_grammar\n"
+                  "from src.chomsky import transform_to_CNF\n"
+                  "for name, params, lengths in CASES[:4]:\n"
+                  "    cnf = transform_to_CNF(_load_lines(generate_grammar(seed=0, **params)))\n"
+                  "    for words in _words(cnf, lengths, 3, random.Random(0)):\n"
+                  "        print(name, [' '.join(map(str, word)) for word in words])\n")
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(".."))
+        runs = [subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True,
+                               check=True).stdout for _ in range(2)]
+        self.assertTrue(runs[0])
+        self.assertEqual(runs[0], runs[1])
+
+    def test_incremental_cyk(self):
+        self._load_cfg("cyk_parser_simple1")
+        incremental = src.CYK_parser.IncrementalCYK(self.cfg)
+        self.assertTrue(incremental.is_viable_prefix())
+        for token in [self.a, self.c, self.a, self.c]:
+            incremental.append(token)
+            self.assertTrue(incremental.is_viable_prefix())
+        self.assertFalse(incremental.accepts())
+        incremental.append(self.c)
+        self.assertTrue(incremental.accepts())
+        incremental.replace(1, self.a)
+        self.assertFalse(incremental.accepts())
+        self.assertFalse(incremental.is_viable_prefix())
+        incremental.replace(1, self.c)
+        self.assertTrue(incremental.accepts())
+        incremental.pop()
+        self.assertFalse(incremental.accepts())
+        incremental.append(self.b)
+        self.assertFalse(incremental.is_viable_prefix())
+
 
 if __name__ == '__main__':
     unittest.main()